@@ -1,5 +1,7 @@
 from flask import Flask
+from utils.utils import MongoJSONProvider
 
 app = Flask(__name__)
+app.json = MongoJSONProvider(app)
 
-from app import views
+from app import views, commands
@@ -0,0 +1,80 @@
+import click
+from app import app
+from models.group_stats import rebuild_group_stats
+from models.daily_counts import rebuild_daily_counts
+from models.query_plans import check_query_plans
+from models.indexes import missing_indexes, ensure_indexes
+from models.models import db
+
+
+@app.cli.command('rebuild-group-stats')
+def rebuild_group_stats_command():
+    """
+    Recount images of all groups into the group_stats collection.
+
+    Usage:
+        flask --app run.py rebuild-group-stats
+    """
+    rebuild_group_stats()
+    click.echo("group_stats collection was rebuilt")
+
+
+@app.cli.command('rebuild-daily-counts')
+@click.option('--batch-size', default=10000, show_default=True,
+              help='Number of images read from the database at once.')
+def rebuild_daily_counts_command(batch_size):
+    """
+    Recount images per creation day and status into daily_status_counts.
+
+    Usage:
+        flask --app run.py rebuild-daily-counts [--batch-size 10000]
+    """
+    rebuild_daily_counts(batch_size=batch_size)
+    click.echo("daily_status_counts collection was rebuilt")
+
+
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    """
+    Explain the queries of the endpoints and fail if any of them scans
+    a whole collection or is not covered by an index as intended.
+
+    Usage:
+        flask --app run.py check-query-plans
+    """
+    failed = False
+    for name, stages, problem in check_query_plans():
+        click.echo(f"{'FAIL' if problem else 'ok':<5} {name}: "
+                   f"{', '.join(stages)}")
+        if problem:
+            failed = True
+            click.echo(f"      {problem}", err=True)
+    if failed:
+        raise click.ClickException("query plans regressed")
+
+
+@app.cli.command('ensure-indexes')
+@click.option('--check', is_flag=True,
+              help='Only warn about missing indexes, do not build them.')
+def ensure_indexes_command(check):
+    """
+    Build indexes declared in models/indexes.py which are missing
+    in the database.
+
+    Usage:
+        flask --app run.py ensure-indexes [--check]
+    """
+    if check:
+        missing = missing_indexes(db)
+        for collection_name, index in missing:
+            click.echo(f"WARNING: index {index.document['name']} "
+                       f"is missing in {collection_name}", err=True)
+        if not missing:
+            click.echo("all declared indexes exist")
+        return
+
+    created = ensure_indexes(db)
+    for collection_name, name in created:
+        click.echo(f"created index {name} in {collection_name}")
+    if not created:
+        click.echo("all declared indexes exist")
@@ -1,16 +1,58 @@
 from app import app
-from flask import request, jsonify
+from flask import request, jsonify, stream_with_context
+from bson.raw_bson import RawBSONDocument
 from markupsafe import escape
-from datetime import datetime, timedelta
+from datetime import datetime
+from functools import partial
+from threading import BrokenBarrierError
 from bson import ObjectId
 from bson.errors import InvalidId
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
 from werkzeug.exceptions import HTTPException
 import json
-from utils.utils import sanitize_json
-from models.models import images_collection, groups_collection
+from utils.utils import (encode_cursor,
+                         iter_json_array,
+                         iter_json_lines,
+                         )
+from utils.raw_bson import iter_raw_documents, document_to_json
+from utils.params import (parse_groups_params,
+                          parse_statistics_params,
+                          statistics_query,
+                          prefers_ndjson,
+                          )
+from models.models import (get_client,
+                           run_in_transaction,
+                           images_collection,
+                           groups_collection,
+                           daily_counts_collection,
+                           )
+from models.pipelines import groups_pipeline
+from models.daily_counts import (move_images_in_daily_counts,
+                                 daily_counts_built,
+                                 )
+from models.group_stats import (move_image_in_group_stats,
+                                move_images_in_group_stats,
+                                group_stats_built,
+                                )
+from models.status_updates import (bulk_update_statuses,
+                                   status_update_query,
+                                   updated_result,
+                                   move_image_in_statistics_cache,
+                                   not_updated_result,
+                                   STATUS_UPDATE_PROJECTION,
+                                   CURRENT_VERSION_PROJECTION,
+                                   UPDATED,
+                                   )
+from models.write_behind import status_update_queue
+from models.statistics_cache import statistics_cache
+from models.warmup import warm_up, warm_up_report
 from config.config import (VALID_STATUSES,
-                           STATISTIC_NUMBER_OF_DAYS,
-                           DEFAULT_PAGINATION_NUMBER_OF_GROUPS_TO_RETURN,
+                           RAW_BSON_RESPONSES,
+                           STREAM_BATCH_SIZE,
+                           BULK_UPDATE_MAX_ITEMS,
+                           STATUS_UPDATE_WRITE_BEHIND,
+                           NDJSON_MIMETYPE,
                            )
 
 
@@ -20,12 +62,13 @@ def get_groups_with_images():
     Endpoint for retrieving a list of groups with associated images.
 
     This endpoint performs the following actions:
-    1. Joins the 'groups' collection with the 'images' collection based on the
-      'group_id' field.
-    2. Sorts and filters the list of images, if necessary.
-    3. Groups the images by their associated group and counts them.
-    4. Returns a JSON response with the grouped data.
-    5. Optionaly paginate response.
+    1. Selects the groups to return sorted by name, optionaly paginated
+      by page number or by an opaque cursor (keyset pagination).
+    2. Joins only the selected groups with the 'images' collection based on
+      the 'group_id' field.
+    3. Sorts and filters the list of images of each group, if necessary.
+    4. Counts images of each group.
+    5. Returns a JSON response with the grouped data.
 
     Args:
         None
@@ -35,7 +78,8 @@ def get_groups_with_images():
         images and counts.
         If a 'status' query parameter is provided and is a valid status,
         the response will
-        only include images with the specified status.
+        only include images with the specified status, groups without
+        such images are returned with an empty images list and count 0.
         If the 'status' parameter is invalid,
         a 400 Bad Request response is returned.
         If a 'page' query parameter is provided and is a valid integer,
@@ -43,6 +87,28 @@ def get_groups_with_images():
         IF a 'groups_per_page' parameter is provided pagination will return
         groups_per_page groups starting from
         group number page * groups_per_page.
+        If a 'cursor' query parameter is provided (empty for the first
+        page) groups_per_page groups following the cursor are returned
+        wrapped as {"groups": [...], "next_cursor": "..."}.
+        Pass next_cursor back as 'cursor' to get the next page,
+        next_cursor is null on the last page. Each page starts with an
+        index seek on (name, _id), so deep pages cost the same as the
+        first one.
+        If an 'images_per_group' query parameter is provided only that
+        number of the most recently updated images is returned for each
+        group, 'count' still holds the total number of images and
+        'has_more' tells if some of them were not returned.
+        If a 'stream' query parameter is 1 or true the response is
+        streamed in chunks while groups are read from the database,
+        so memory used does not depend on the number of groups returned.
+        If the Accept header prefers application/x-ndjson the response
+        is streamed as JSON Lines, one group per line written as soon as
+        the database returns it. In cursor mode the last line is
+        {"next_cursor": "..."}.
+        If a 'fields' query parameter is provided (comma separated list)
+        only these fields of images are returned, '_id' is always returned.
+        By default 'group_id' of images is not returned as it repeats
+        '_id' of the group.
 
     HTTP Methods:
         GET
@@ -69,9 +135,6 @@ def get_groups_with_images():
                 "created_at": {
                 "$date": "2023-09-17T15:37:19.276Z"
                 },
-                "group_id": {
-                "$oid": "65071d2d96b52de451f914c0"
-                },
                 "last_updated_at": {
                 "$date": "2023-09-28T11:04:39.472Z"
                 },
@@ -85,9 +148,6 @@ def get_groups_with_images():
                 "created_at": {
                 "$date": "2023-09-17T15:37:18.683Z"
                 },
-                "group_id": {
-                "$oid": "65071d2d96b52de451f914c0"
-                },
                 "last_updated_at": {
                 "$date": "2023-09-28T10:57:23.642Z"
                 },
@@ -102,87 +162,171 @@ def get_groups_with_images():
     """
 
     status_filter = request.args.get('status')
-    groups_per_page = DEFAULT_PAGINATION_NUMBER_OF_GROUPS_TO_RETURN
-    groups_per_page = request.args.get('groups_per_page') or groups_per_page
-    page_to_return = request.args.get('page')
+    cursor = request.args.get('cursor')
+    stream = request.args.get('stream') in ('1', 'true')
 
-    pipeline = [
-        # 1 stage join collections by group_id field
-        {
-            '$lookup': {
-                'from': 'images',
-                'localField': '_id',
-                'foreignField': 'group_id',
-                'as': 'images'
-            }
-        },
-        {
-            # 2d stage
-            # we need to destruct list of images to sort and filter (if needed)
-            '$unwind': '$images'
-        },
-        {
-            # 3d stage
-            # sort by creation date
-            '$sort': {
-                # 'images.created_at': 1
-                'images.last_updated_at': -1
-
-            }
-
-        },
-        {
-            # 4th stage group images back by group id
-            # add count field and get back name of the group filed
-            '$group': {
-                '_id': '$_id',
-                'name': {'$first': '$name'},
-                'images': {'$push': '$images'},
-                'count':  {'$sum': 1}
-            }
-        },
-        {
-            # for debuging purposes we don't need this sort in production
-            '$sort': {
-                'name': 1
-            }
-        },
-    ]
-
-    if status_filter and escape(status_filter) in VALID_STATUSES:
-        pipeline.insert(2, {'$match': {'images.status': status_filter}})
-    elif status_filter:
+    if status_filter and escape(status_filter) not in VALID_STATUSES:
         return jsonify({
             "code": 400,
             "name": "Invalid status",
             "description": (f"Valid statuses are - {VALID_STATUSES}"),
             }), 400
 
-    # add pagination if we have a big number of groups
-    if page_to_return:
-        try:
-            skip = int(escape(page_to_return)) * int(escape(groups_per_page))
-            limit = int(escape(groups_per_page))
-        except ValueError as err:
-            return jsonify({
-                "code": 400,
-                "name": "Invalid values of query parameters",
-                "description": str(err),
-                }), 400
-        pipeline.extend([
-                            {
-                                '$skip': skip
-                            },
-                            {
-                                '$limit': limit
-                            },
-                        ])
+    try:
+        params = parse_groups_params(request.args)
+    except ValueError as err:
+        return jsonify({
+            "code": 400,
+            "name": "Invalid values of query parameters",
+            "description": str(err),
+            }), 400
+
+    limit = params['limit']
+    if params['images_per_group'] is not None:
+        params['count_from_group_stats'] = group_stats_built()
+    pipeline = groups_pipeline(status_filter=status_filter, **params)
+
+    ndjson = wants_ndjson()
+    if stream or ndjson:
+        return get_groups_streaming_response(pipeline,
+                                             cursor is not None,
+                                             limit,
+                                             ndjson=ndjson,
+                                             )
+
+    if RAW_BSON_RESPONSES:
+        return get_groups_raw_response(pipeline, cursor is not None, limit)
 
-    groups = sanitize_json(list(groups_collection.aggregate(pipeline)))
+    groups = list(groups_collection.aggregate(pipeline))
+
+    if cursor is not None:
+        next_cursor = (encode_cursor(groups[-1]) if len(groups) == limit
+                       else None)
+        return jsonify({
+            'groups': groups,
+            'next_cursor': next_cursor,
+            }), 200
 
     return jsonify(groups), 200
 
 
+def get_groups_raw_response(pipeline, with_cursor, limit):
+    """
+    Return the /groups response transcoded straight from raw BSON.
+
+    Used when RAW_BSON_RESPONSES is enabled in config. The aggregation
+    result is fetched as raw BSON batches and written to JSON without
+    building python dicts for documents, the response is the same
+    as jsonify returns.
+
+    Args:
+        pipeline (list): Groups aggregation pipeline.
+        with_cursor (bool): Wrap groups with next_cursor (cursor mode).
+        limit (int | None): Number of groups on the page.
+
+    Returns:
+        A JSON response with the list of groups.
+    """
+    documents = list(iter_raw_documents(
+        groups_collection.aggregate_raw_batches(pipeline)
+        ))
+    body = '[' + ','.join(map(document_to_json, documents)) + ']'
+
+    if with_cursor:
+        next_cursor = None
+        if len(documents) == limit:
+            next_cursor = encode_cursor(RawBSONDocument(documents[-1]))
+        body = (f'{{"groups":{body},'
+                f'"next_cursor":{json.dumps(next_cursor)}}}')
+
+    return app.response_class(f"{body}\n", mimetype='application/json'), 200
+
+
+def get_groups_streaming_response(pipeline, with_cursor, limit,
+                                  ndjson=False):
+    """
+    Return the /groups response streamed while the cursor is iterated.
+
+    Groups are fetched from MongoDB in batches of STREAM_BATCH_SIZE
+    and written to the response as soon as they arrive,
+    so memory used by the worker does not depend on the number of groups.
+
+    Args:
+        pipeline (list): Groups aggregation pipeline.
+        with_cursor (bool): Add next_cursor to the response (cursor mode).
+        limit (int | None): Number of groups on the page.
+        ndjson (bool): Write one group per line (JSON Lines)
+            instead of a JSON array.
+
+    Returns:
+        A chunked JSON or NDJSON response with the list of groups.
+    """
+    if RAW_BSON_RESPONSES:
+        documents = iter_raw_documents(groups_collection.aggregate_raw_batches(
+            pipeline,
+            batchSize=STREAM_BATCH_SIZE,
+            ))
+        to_json = document_to_json
+    else:
+        documents = groups_collection.aggregate(pipeline,
+                                                batchSize=STREAM_BATCH_SIZE,
+                                                )
+        to_json = partial(app.json.dumps, separators=(',', ':'))
+
+    # remember the number of groups and the last one
+    # to build next_cursor from them
+    seen = {'count': 0, 'last': None}
+
+    def remember_last(documents):
+        for document in documents:
+            seen['count'] += 1
+            seen['last'] = document
+            yield document
+
+    def get_next_cursor():
+        if seen['count'] != limit:
+            return None
+        last = seen['last']
+        if RAW_BSON_RESPONSES:
+            last = RawBSONDocument(last)
+        return encode_cursor(last)
+
+    def generate():
+        if ndjson:
+            yield from iter_json_lines(remember_last(documents), to_json)
+            if with_cursor:
+                yield f'{{"next_cursor":{json.dumps(get_next_cursor())}}}\n'
+            return
+
+        if not with_cursor:
+            yield from iter_json_array(documents, to_json, STREAM_BATCH_SIZE)
+            yield '\n'
+            return
+
+        yield '{"groups":'
+        yield from iter_json_array(remember_last(documents),
+                                   to_json,
+                                   STREAM_BATCH_SIZE,
+                                   )
+        yield f',"next_cursor":{json.dumps(get_next_cursor())}}}\n'
+
+    mimetype = NDJSON_MIMETYPE if ndjson else 'application/json'
+    return app.response_class(stream_with_context(generate()),
+                              mimetype=mimetype,
+                              ), 200
+
+
+def wants_ndjson():
+    """
+    Check if the client asked for NDJSON (JSON Lines) in Accept header.
+
+    Returns:
+        bool: True if application/x-ndjson is preferred over
+        application/json.
+    """
+    return prefers_ndjson(request.accept_mimetypes)
+
+
 @app.route('/images/<image_id>', methods=['PUT'])
 def update_image_status(image_id):
     """
@@ -208,6 +352,11 @@ def update_image_status(image_id):
             "status": "new_status"
         }
 
+    Headers:
+        If-Match (optional): ETag (version) of the image as returned by
+        GET /images/<image_id> or a previous update. The image is updated
+        only if it still has this version.
+
     Returns:
         A JSON response indicating the result of the status update:
         - If the 'image_id' is in an invalid format, a 400 Bad Request
@@ -221,6 +370,14 @@ def update_image_status(image_id):
         - If an exception occurs during the database update, a 500 Internal
         Server Error response
         with an error description is returned.
+        - If If-Match header is provided and the image was changed since,
+        a 412 Precondition Failed response is returned.
+        - Successful responses have an ETag header with the image version.
+        - If STATUS_UPDATE_WRITE_BEHIND is enabled in config and there is
+        no If-Match header, a 202
+        Accepted response is returned as soon as the update is queued,
+        it is written to the database in background, coalesced with other
+        updates of the same image.
 
     Example Usage:
         PUT /images/5f76b5c5a548ebe57f213b3a
@@ -283,40 +440,441 @@ def update_image_status(image_id):
             "description": (f"Valid statuses are - {VALID_STATUSES}"),
             }), 400
 
-    try:
-        # Get the current status before updating
-        current_status = images_collection.find_one(
-            {'_id': image_id},
-            {'status': 1},
+    # a precondition can not be checked later, so conditional
+    # requests are always written at once
+    if STATUS_UPDATE_WRITE_BEHIND and not request.if_match:
+        status_update_queue.put(image_id, new_status)
+        return jsonify({
+            'message': 'Image status update queued'
+            }), 202
+
+    image_filter, update = status_update_query(image_id,
+                                               new_status,
+                                               request.if_match,
+                                               )
+
+    def write(session):
+        # compare and set: update only if the status changes (and the
+        # version matches If-Match) and get the image before the update
+        # in the same round trip
+        image = images_collection.find_one_and_update(
+            image_filter,
+            update,
+            projection=STATUS_UPDATE_PROJECTION,
+            return_document=ReturnDocument.BEFORE,
+            session=session,
             )
-        current_status = current_status['status'] if current_status else None
+        if image:
+            move_image_in_group_stats(image['group_id'],
+                                      image['status'],
+                                      new_status,
+                                      session=session,
+                                      )
+            move_images_in_daily_counts([(image['created_at'],
+                                          image['status'],
+                                          new_status,
+                                          1,
+                                          )],
+                                        session=session,
+                                        )
+        return image
 
-        if new_status != current_status:
-            result = images_collection.update_one(
-                {
-                    '_id': image_id
-                },
-                {
-                    '$set': {
-                        'status': new_status,
-                        'last_updated_at': datetime.utcnow()
-                        }
-                }
-                )
-            if result.modified_count:
-                return jsonify({
-                    'message': 'Image status updated'
-                    }), 200
-            else:
-                return jsonify({
-                    "code": 400,
-                    "name": "Image not found",
-                    "description": "Specified ID was not found in database",
-                    }), 400
+    try:
+        # a queued update of the image is older, write it first
+        status_update_queue.flush([image_id])
+        generation = statistics_cache.begin_write()
+        # the image and its counts are updated together or not at all
+        image = run_in_transaction(write)
+        if image:
+            move_image_in_statistics_cache(image, new_status, generation)
+            body, status_code, etag = updated_result(image)
         else:
+            # nothing was updated, find out why
+            image = images_collection.find_one({'_id': image_id},
+                                               CURRENT_VERSION_PROJECTION,
+                                               )
+            body, status_code, etag = not_updated_result(image,
+                                                         request.if_match,
+                                                         )
+        response = jsonify(body)
+        if etag is not None:
+            response.set_etag(etag)
+        return response, status_code
+
+    except Exception as err:
+        return jsonify({
+                "code": 500,
+                "name": "MongoDB exeption occured",
+                "description": str(err),
+            }), 500
+
+
+@app.route('/images/<image_id>', methods=['GET'])
+def get_image(image_id):
+    """
+    Endpoint for retrieving an image by its unique identifier.
+
+    The response has an ETag header with the image version. Send it back
+    in If-None-Match header to get 304 Not Modified if the image was not
+    changed, or in If-Match header of PUT /images/<image_id> to update the
+    image only if nobody changed it in the meantime.
+
+    Args:
+        image_id (str): The unique identifier of the
+        image (in ObjectId format).
+
+    HTTP Methods:
+        GET
+
+    Route:
+        /images/<image_id>
+
+    Response:
+        {
+            "_id": {"$oid": "65071d2f96b52de451f914c2"},
+            "created_at": {"$date": "2023-09-17T15:37:19.276Z"},
+            "group_id": {"$oid": "65071d2d96b52de451f914c0"},
+            "last_updated_at": {"$date": "2023-09-28T11:04:39.472Z"},
+            "status": "accepted",
+            "url": "https://images_service.com/output/group_0_image_1.png",
+            "version": 3
+        }
+    """
+    try:
+        image_id = ObjectId(image_id)
+    except InvalidId as err:
+        # object id is in wrong format
+        return jsonify({
+            "code": 400,
+            "name": "Invalid ObjectId",
+            "description": str(err),
+        }), 400
+
+    image = images_collection.find_one({'_id': image_id})
+    if not image:
+        return jsonify({
+            "code": 404,
+            "name": "Image not found",
+            "description": "Specified ID was not found in database",
+            }), 404
+
+    image.setdefault('version', 0)
+    response = jsonify(image)
+    response.set_etag(str(image['version']))
+    return response.make_conditional(request)
+
+
+@app.route('/images', methods=['PATCH'])
+def update_images_statuses():
+    """
+    Endpoint to change the statuses of many images at once.
+
+    All items are validated before anything is written, then the updates
+    are executed as one unordered bulk write. The result of every item is
+    returned.
+
+    Args:
+        None
+
+    HTTP Methods:
+        PATCH
+
+    Route:
+        /images
+
+    Request JSON:
+        [
+            {"id": "<image_id>", "status": "new_status"},
+            ...
+        ]
+
+    Returns:
+        A JSON response with the result of every item:
+        - If the request JSON is not a list of {"id", "status"} objects,
+        has more than BULK_UPDATE_MAX_ITEMS items, or any of the ids or
+        statuses is invalid, a 400 Bad Request response is returned
+        and no image is updated.
+        - Otherwise a 200 OK response with results of all items.
+        The result of an item is one of:
+            "updated" - status was changed,
+            "unchanged" - image already had this status,
+            "not_found" - there is no image with this id.
+        If an image is listed several times the last status wins.
+        - If an exception occurs during the database update, a 500 Internal
+        Server Error response with an error description is returned.
+
+    Example Usage:
+        PATCH /images
+
+    Request JSON:
+        [
+            {"id": "5f76b5c5a548ebe57f213b3a", "status": "accepted"},
+            {"id": "5f76b5c5a548ebe57f213b3b", "status": "accepted"}
+        ]
+
+    Response (Success):
+        {
+            "results": [
+                {"id": "5f76b5c5a548ebe57f213b3a", "result": "updated"},
+                {"id": "5f76b5c5a548ebe57f213b3b", "result": "unchanged"}
+            ],
+            "updated": 1
+        }
+
+    Response (Invalid Items):
+        {
+            "code": 400,
+            "name": "Invalid items",
+            "description": "Item 1: Valid statuses are -
+                    ['new', 'review', 'accepted', 'deleted']"
+        }
+    """
+    data = request.get_json()
+    if not isinstance(data, list) or len(data) > BULK_UPDATE_MAX_ITEMS:
+        return jsonify({
+            "code": 400,
+            "name": "Invalid items",
+            "description": (f"Request JSON must be a list of at most "
+                            f"{BULK_UPDATE_MAX_ITEMS} objects "
+                            f"with id and status"),
+            }), 400
+
+    updates = []
+    errors = []
+    for index, item in enumerate(data):
+        if not isinstance(item, dict) or not isinstance(item.get('id'), str):
+            errors.append(f"Item {index}: must be an object "
+                          f"with id and status")
+            continue
+        try:
+            image_id = ObjectId(item['id'])
+        except InvalidId as err:
+            errors.append(f"Item {index}: {err}")
+            continue
+        if item.get('status') not in VALID_STATUSES:
+            errors.append(f"Item {index}: "
+                          f"Valid statuses are - {VALID_STATUSES}")
+            continue
+        updates.append((image_id, item['status']))
+
+    if errors:
+        return jsonify({
+            "code": 400,
+            "name": "Invalid items",
+            "description": "; ".join(errors),
+            }), 400
+
+    try:
+        # queued updates of the images are older, write them first
+        status_update_queue.flush(image_id for image_id, _ in updates)
+        results = bulk_update_statuses(updates)
+    except Exception as err:
+        return jsonify({
+                "code": 500,
+                "name": "MongoDB exeption occured",
+                "description": str(err),
+            }), 500
+    statistics_cache.clear()
+
+    return jsonify({
+        'results': [{'id': str(image_id), 'result': results[image_id]}
+                    for image_id, _ in updates],
+        'updated': sum(result == UPDATED for result in results.values()),
+        }), 200
+
+
+@app.route('/images/status-queue', methods=['GET'])
+def get_status_queue_metrics():
+    """
+    Endpoint to retrieve metrics of the write-behind status update queue.
+
+    The queue exists in every worker process, so metrics are of the worker
+    which handled the request.
+
+    HTTP Methods:
+        GET
+
+    Route:
+        /images/status-queue
+
+    Response:
+        {
+            "coalesced": 12,
+            "depth": 3,
+            "errors": 0,
+            "flushed": 120,
+            "flushes": 15,
+            "last_flush_seconds": 0.004,
+            "max_flush_seconds": 0.021,
+            "queued": 135
+        }
+    """
+    return jsonify(status_update_queue.metrics()), 200
+
+
+@app.route('/groups/<group_id>/images/status', methods=['PUT'])
+def update_group_images_status(group_id):
+    """
+    Endpoint to change the status of all images of a group.
+
+    All images of the group (optionally only those with 'from_status')
+    get the new status with one server side update, using
+    the images (group_id, status, ...) index.
+    'last_updated_at' is set only for images whose status changes,
+    the same way as for a single image update. The images are counted
+    and updated and their group and daily counts moved in one
+    transaction.
+
+    Args:
+        group_id (str): The unique identifier of the
+        group (in ObjectId format).
+
+    HTTP Methods:
+        PUT
+
+    Route:
+        /groups/<group_id>/images/status
+
+    Request JSON:
+        {
+            "status": "new_status",
+            "from_status": "current_status"  (optional)
+        }
+
+    Returns:
+        A JSON response indicating the result of the status update:
+        - If the 'group_id' is in an invalid format, a 400 Bad Request
+        response is returned.
+        - If the 'status' or 'from_status' provided is not a valid status,
+        a 400 Bad Request response is returned.
+        - If the specified group ID is not found in the database, a 400 Bad
+        Request response is returned.
+        - Otherwise a 200 OK response with the number of updated images.
+        - If an exception occurs during the database update, a 500 Internal
+        Server Error response with an error description is returned.
+
+    Example Usage:
+        PUT /groups/65071d2d96b52de451f914c0/images/status
+
+    Request JSON:
+        {
+            "status": "accepted",
+            "from_status": "review"
+        }
+
+    Response (Success):
+        {
+            "message": "Images status updated",
+            "updated": 3
+        }
+
+    Response (Group Not Found):
+        {
+            "code": 400,
+            "name": "Group not found",
+            "description": "Specified ID was not found in database"
+        }
+    """
+    try:
+        group_id = ObjectId(group_id)
+    except InvalidId as err:
+        # object id is in wrong format
+        return jsonify({
+            "code": 400,
+            "name": "Invalid ObjectId",
+            "description": str(err),
+        }), 400
+
+    data = request.get_json()
+    new_status = data.get('status')
+    from_status = data.get('from_status')
+    if new_status not in VALID_STATUSES or (
+            from_status is not None and from_status not in VALID_STATUSES):
+        return jsonify({
+            "code": 400,
+            "name": "Invalid status",
+            "description": (f"Valid statuses are - {VALID_STATUSES}"),
+            }), 400
+
+    # images which already have the new status are not touched
+    status_condition = {'$ne': new_status}
+    if from_status:
+        status_condition['$eq'] = from_status
+
+    now = datetime.utcnow()
+
+    def write(session):
+        # images which are going to move per creation day and status
+        # for the counts, only a group is read through the index
+        moves = list(images_collection.aggregate([
+            {
+                '$match': {'group_id': group_id, 'status': status_condition}
+            },
+            {
+                '$group': {
+                    '_id': {
+                        'day': {
+                            '$dateTrunc': {'date': '$created_at',
+                                           'unit': 'day',
+                                           }
+                        },
+                        'status': '$status',
+                    },
+                    'count': {'$sum': 1},
+                }
+            },
+        ], session=session))
+
+        result = images_collection.update_many(
+            {
+                'group_id': group_id,
+                'status': status_condition,
+            },
+            {
+                '$set': {
+                    'status': new_status,
+                    'last_updated_at': now
+                    },
+                '$inc': {'version': 1},
+            },
+            session=session,
+            )
+
+        # the transaction reads and writes the same snapshot, so exactly
+        # the counted images are updated, a concurrent change of one of
+        # them is a write conflict and the transaction is run again
+        move_images_in_group_stats(
+            group_id,
+            ((move['_id']['status'], move['count']) for move in moves),
+            new_status,
+            session=session,
+            )
+        move_images_in_daily_counts(
+            ((move['_id']['day'], move['_id']['status'], new_status,
+              move['count'])
+             for move in moves),
+            session=session,
+            )
+        return result.modified_count
+
+    try:
+        # queued updates may be of images of the group, write them first
+        status_update_queue.flush()
+        updated = run_in_transaction(write)
+        if updated:
+            statistics_cache.clear()
+        elif not groups_collection.count_documents({'_id': group_id},
+                                                   limit=1):
             return jsonify({
-                'message': 'Requested status is the same as current'
-                }), 200
+                "code": 400,
+                "name": "Group not found",
+                "description": "Specified ID was not found in database",
+                }), 400
+
+        return jsonify({
+            'message': 'Images status updated',
+            'updated': updated,
+            }), 200
 
     except Exception as err:
         return jsonify({
@@ -329,12 +887,12 @@ def update_image_status(image_id):
 @app.route('/statistics', methods=['GET'])
 def get_statistics():
     """
-    Endpoint to retrieve statistics for images created in the last 30 days.
+    Endpoint to retrieve statistics for images created in a period.
 
     This endpoint calculates statistics based on images'
-    creation dates within the last 30 days.
+    creation dates within the last 30 days or the requested period.
     It counts images grouped by their 'status' field and returns
-    the counts as a JSON response.
+    the counts as a JSON response, in total or per hour, day or week.
 
     Args:
         None
@@ -345,13 +903,26 @@ def get_statistics():
     Route:
         /statistics
 
+    Query Parameters:
+        - days (int, optional): Number of the last days to count images of.
+        Default is 30.
+        - from (str, optional): ISO 8601 date or datetime, count images
+        created since then. Can not be combined with days.
+        - to (str, optional): ISO 8601 date or datetime, count images
+        created before then. Default is now.
+        - bucket (str, optional): 'hour', 'day' or 'week' to return counts
+        per bucket of creation dates instead of totals.
+        - group_id (str, optional): Count only images of this group.
+
     Returns:
         A JSON response containing statistics
-        for images created in the last 30 days. The statistics are grouped
+        for images created in the period. The statistics are grouped
         by 'status'and include the count of images for each status.
 
     Example Usage:
         GET /statistics
+        GET /statistics?days=365&bucket=day
+        GET /statistics?from=2023-09-01&to=2023-10-01&bucket=week
 
     Response:
         {
@@ -360,42 +931,224 @@ def get_statistics():
             "pending": 8
         }
 
+    Response (bucket=day):
+        {
+            "bucket": "day",
+            "from": {"$date": "2023-09-01T00:00:00Z"},
+            "to": {"$date": "2023-10-01T00:00:00Z"},
+            "series": [
+                {
+                    "start": {"$date": "2023-09-01T00:00:00Z"},
+                    "counts": {"approved": 3, "pending": 1}
+                },
+                ...
+            ]
+        }
+
+    Response (Accept: application/x-ndjson):
+        {"count":12,"status":"approved"}
+        {"count":5,"status":"rejected"}
+        {"count":8,"status":"pending"}
+
+        With bucket one item of the series per line.
+
     Notes:
         - The endpoint uses a default period of the last 30 days
         to calculate statistics.
         - Images outside this time frame are excluded from the statistics.
+        - The period includes 'from' and excludes 'to'. Dates without time
+        zone are UTC, buckets are UTC hours, days and weeks from monday.
+        - Buckets without images are left out of the series. The first and
+        the last bucket count only images of the period.
+        - With STATISTICS_ENGINE 'rollup' (default) counts are summed from
+        the daily_status_counts collection. 'days' are then calendar days
+        including today and 'from' and 'to' have to be dates (midnight).
+        Otherwise, with 'bucket=hour', 'group_id' and with
+        STATISTICS_ENGINE 'images' the images created in the exact period
+        are counted.
+        - Results are cached per worker for STATISTICS_CACHE_TTL seconds,
+        see models/statistics_cache.py.
     """
-    # days = request.args.get('days')
-    # try:
-    #    days = int(days)
-    # except ValueError:
-    #     return jsonify({
-    #         "code": 400,
-    #         "name": "wrong filter",
-    #         "description": "filter must be a number of days",
-    #         }), 400
-    # days = days if days else STATISTIC_NUMBER_OF_DAYS
-    days = STATISTIC_NUMBER_OF_DAYS
-    end_date = datetime.utcnow()
-    start_date = end_date - timedelta(days=days)
-    print(start_date)
-    pipeline = [
-        {
-            '$match': {
-                'created_at': {'$gte': start_date, '$lte': end_date}
-            }
-        },
+    return get_statistics_response(request.args.get('group_id'))
+
+
+@app.route('/groups/<group_id>/statistics', methods=['GET'])
+def get_group_statistics(group_id):
+    """
+    Endpoint to retrieve statistics for images of one group.
+
+    The same as /statistics?group_id=<group_id>. Images are counted with
+    an aggregation covered by the images (group_id, created_at, status)
+    index, so only index keys of the group and the period are read.
+
+    Args:
+        group_id (str): The unique identifier of the
+        group (in ObjectId format).
+
+    HTTP Methods:
+        GET
+
+    Route:
+        /groups/<group_id>/statistics
+
+    Query Parameters:
+        - days, from, to, bucket: The same as of /statistics.
+
+    Returns:
+        A JSON response with the counts of images of the group per status,
+        or per bucket and status, in the format of /statistics.
+        - If the 'group_id' is in an invalid format or the group is not
+        found, a 400 Bad Request response is returned.
+
+    Example Usage:
+        GET /groups/65071d2d96b52de451f914c0/statistics?days=7&bucket=day
+    """
+    return get_statistics_response(group_id)
+
+
+def get_statistics_response(group_id):
+    """
+    Build the response of /statistics, of all images or of one group.
+
+    Args:
+        group_id (str | None): Group to count images of, in ObjectId format.
+
+    Returns:
+        Response of /statistics or a 400 Bad Request response.
+    """
+    if group_id is not None:
+        try:
+            group_id = ObjectId(group_id)
+        except InvalidId as err:
+            # object id is in wrong format
+            return jsonify({
+                "code": 400,
+                "name": "Invalid ObjectId",
+                "description": str(err),
+            }), 400
+
+    try:
+        params = parse_statistics_params(request.args)
+    except ValueError as err:
+        return jsonify({
+            "code": 400,
+            "name": "Invalid values of query parameters",
+            "description": str(err),
+            }), 400
+    bucket = params['bucket']
+    start_date, end_date = params['start_date'], params['end_date']
+
+    # the period of 'days' moves with the time, so results are cached
+    # by the query parameters together with the period they counted
+    key = (group_id, *params['key'])
+    cached = statistics_cache.get(key)
+    if cached is not None:
+        start_date, end_date, value = cached
+    else:
+        generation = statistics_cache.begin_read()
+        use_daily_counts, pipeline, options = statistics_query(
+            start_date,
+            end_date,
+            bucket,
+            group_id,
+            daily_counts_built(),
+            )
+        collection = (daily_counts_collection if use_daily_counts
+                      else images_collection)
+        items = collection.aggregate(pipeline, **options)
+        if bucket:
+            value = list(items)
+        else:
+            value = {item['_id']: item['count'] for item in items}
+        # a group without images in the period may not exist at all
+        if (not value and group_id is not None
+                and not groups_collection.count_documents({'_id': group_id},
+                                                          limit=1)):
+            return jsonify({
+                "code": 400,
+                "name": "Group not found",
+                "description": "Specified ID was not found in database",
+                }), 400
+        statistics_cache.put(key, start_date, end_date, bucket, value,
+                             group_id,
+                             generation,
+                             )
+
+    if bucket:
+        if wants_ndjson():
+            lines = iter_json_lines(
+                value,
+                partial(app.json.dumps, separators=(',', ':')),
+                )
+            return app.response_class(stream_with_context(lines),
+                                      mimetype=NDJSON_MIMETYPE,
+                                      ), 200
+        return jsonify({
+            'bucket': bucket,
+            'from': start_date,
+            'to': end_date,
+            'series': value,
+            }), 200
+
+    if wants_ndjson():
+        lines = iter_json_lines(
+            ({'status': status, 'count': count}
+             for status, count in value.items()),
+            partial(app.json.dumps, separators=(',', ':')),
+            )
+        return app.response_class(stream_with_context(lines),
+                                  mimetype=NDJSON_MIMETYPE,
+                                  ), 200
+
+    return jsonify(value), 200
+
+
+@app.route('/healthz/ready', methods=['GET'])
+def get_readiness():
+    """
+    Readiness endpoint for load balancers and orchestrators.
+
+    The worker is ready when its MongoDB connections are warmed up
+    (see models/warmup.py) and the server answers a ping. A worker which
+    was not warmed up at boot warms up on the first request.
+
+    HTTP Methods:
+        GET
+
+    Route:
+        /healthz/ready
+
+    Returns:
+        - A 200 OK response with the warm-up report of the worker.
+        - A 503 Service Unavailable response if MongoDB is not reachable.
+
+    Response:
         {
-            '$group': {
-                '_id': '$status',
-                'count': {'$sum': 1}
+            "status": "ready",
+            "warm_up": {
+                "connections": 4,
+                "ping_ms": 412.3,
+                "queries_ms": 35.1,
+                "total_ms": 447.4
             }
         }
-    ]
+    """
+    try:
+        report = warm_up_report()
+        if report is None:
+            report = warm_up()
+        else:
+            get_client().admin.command('ping')
+    except (PyMongoError, BrokenBarrierError) as err:
+        # the barrier breaks if the pings of the warm-up can not start
+        # together in time
+        return jsonify({
+            "code": 503,
+            "name": "Not ready",
+            "description": str(err) or "MongoDB warm-up timed out",
+            }), 503
 
-    items = images_collection.aggregate(pipeline)
-    statistics = sanitize_json({item['_id']: item['count'] for item in items})
-    return jsonify(statistics), 200
+    return jsonify({'status': 'ready', 'warm_up': report}), 200
 
 
 @app.errorhandler(HTTPException)
@@ -0,0 +1,39 @@
+"""
+ASGI Variant of the Service
+
+Serves GET /groups, PUT /images/<image_id> and GET /statistics (also
+/groups/<group_id>/statistics) with the Motor async MongoDB driver, with
+the same responses as the Flask application. A worker handles many
+requests at once while they wait for MongoDB, instead of one request
+per gunicorn thread.
+
+Other endpoints are served by the Flask application only.
+
+To run the ASGI application:
+
+- run uvicorn with
+    uvicorn asgi_app:app --host 0.0.0.0 --port 8000 --workers 2
+"""
+
+from starlette.applications import Starlette
+from starlette.routing import Route
+from asgi_app.db import close_client
+from asgi_app.views import (get_groups_with_images,
+                            update_image_status,
+                            get_statistics,
+                            get_group_statistics,
+                            exception_handlers,
+                            )
+
+app = Starlette(
+    routes=[
+        Route('/groups', get_groups_with_images, methods=['GET']),
+        Route('/images/{image_id}', update_image_status, methods=['PUT']),
+        Route('/statistics', get_statistics, methods=['GET']),
+        Route('/groups/{group_id}/statistics', get_group_statistics,
+              methods=['GET'],
+              ),
+    ],
+    exception_handlers=exception_handlers,
+    on_shutdown=[close_client],
+)
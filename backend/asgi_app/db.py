@@ -0,0 +1,89 @@
+"""
+Async MongoDB Database Setup
+
+The ASGI variant of the service reads and writes MongoDB with Motor,
+the asyncio driver, so a worker serves many requests at once on one event
+loop instead of one request per thread.
+
+Like 'models.models' the client is created lazily on first use in every
+process (uvicorn workers are separate processes), within the running event
+loop. Indexes are the same as of the sync service, see 'models.indexes'.
+
+Usage:
+    from asgi_app.db import images_collection
+    image = await images_collection.find_one({'_id': image_id})
+"""
+
+import os
+from motor.motor_asyncio import AsyncIOMotorClient
+from config.config import (MONGODB_URI,
+                           MONGODB_DB_NAME,
+                           MONGODB_IMAGE_COLLECTION_NAME,
+                           MONGODB_GROUPS_COLLECTION_NAME,
+                           MONGODB_GROUP_STATS_COLLECTION_NAME,
+                           MONGODB_DAILY_COUNTS_COLLECTION_NAME,
+                           MONGODB_ASYNC_MAX_POOL_SIZE,
+                           )
+
+_client = None
+_client_pid = None
+
+
+def get_client():
+    """
+    Return the Motor client of this process, create it on first use.
+
+    Returns:
+        AsyncIOMotorClient: Client of this process.
+    """
+    global _client, _client_pid
+    # requests of a worker run on one event loop thread, no lock needed
+    if _client is None or _client_pid != os.getpid():
+        _client = AsyncIOMotorClient(MONGODB_URI,
+                                     maxPoolSize=MONGODB_ASYNC_MAX_POOL_SIZE,
+                                     )
+        _client_pid = os.getpid()
+    return _client
+
+
+async def run_in_transaction(callback):
+    """
+    Run callback in a transaction, see models.models.run_in_transaction.
+
+    Args:
+        callback (callable): Coroutine function taking the session.
+
+    Returns:
+        The return value of the callback.
+    """
+    async with await get_client().start_session() as session:
+        return await session.with_transaction(callback)
+
+
+def close_client():
+    """Close the Motor client of this process, if it was created."""
+    global _client
+    if _client is not None and _client_pid == os.getpid():
+        _client.close()
+    _client = None
+
+
+class _LazyCollection:
+    """A collection of the application database of this process."""
+
+    def __init__(self, name):
+        self._collection_name = name
+
+    def __getattr__(self, name):
+        return getattr(get_client()[MONGODB_DB_NAME][self._collection_name],
+                       name,
+                       )
+
+
+# Access the collections in the database
+images_collection = _LazyCollection(MONGODB_IMAGE_COLLECTION_NAME)
+groups_collection = _LazyCollection(MONGODB_GROUPS_COLLECTION_NAME)
+group_stats_collection = _LazyCollection(MONGODB_GROUP_STATS_COLLECTION_NAME)
+daily_counts_collection = _LazyCollection(
+    MONGODB_DAILY_COUNTS_COLLECTION_NAME
+    )
@@ -0,0 +1,572 @@
+"""
+Async Endpoints of the ASGI Variant
+
+GET /groups, PUT /images/<image_id> and GET /statistics served with Motor.
+Query parameters are parsed by 'utils.params' and the pipelines are built
+by 'models.pipelines', the same as in app/views.py, and responses are
+serialized the same as Flask 'jsonify' with 'MongoJSONProvider' does, so
+both variants answer a request with the same status, headers and body.
+See app/views.py for the documentation of the endpoints.
+"""
+
+import asyncio
+import json
+from bson import ObjectId
+from bson.errors import InvalidId
+from bson.raw_bson import RawBSONDocument
+from markupsafe import escape
+from pymongo import ReturnDocument
+from starlette.exceptions import HTTPException as StarletteHTTPException
+from starlette.responses import Response, StreamingResponse
+from werkzeug.datastructures import MIMEAccept, MultiDict
+from werkzeug.exceptions import (HTTPException,
+                                 BadRequest,
+                                 InternalServerError,
+                                 UnsupportedMediaType,
+                                 default_exceptions,
+                                 )
+from werkzeug.http import parse_accept_header, parse_etags, quote_etag
+from asgi_app.db import (run_in_transaction,
+                         images_collection,
+                         groups_collection,
+                         group_stats_collection,
+                         daily_counts_collection,
+                         )
+from utils.utils import MongoJSONProvider, encode_cursor, iter_json_lines
+from utils.raw_bson import iter_raw_documents, document_to_json
+from utils.params import (parse_groups_params,
+                          parse_statistics_params,
+                          statistics_query,
+                          prefers_ndjson,
+                          )
+from models.pipelines import groups_pipeline
+from models.group_stats import group_stats_move, BUILT_MARKER_ID
+from models.daily_counts import (daily_counts_operations,
+                                 BUILT_MARKER_ID as DAILY_COUNTS_BUILT,
+                                 )
+from models.status_updates import (status_update_query,
+                                   updated_result,
+                                   move_image_in_statistics_cache,
+                                   not_updated_result,
+                                   STATUS_UPDATE_PROJECTION,
+                                   CURRENT_VERSION_PROJECTION,
+                                   )
+from models.write_behind import status_update_queue
+from models.statistics_cache import statistics_cache
+from config.config import (VALID_STATUSES,
+                           RAW_BSON_RESPONSES,
+                           STREAM_BATCH_SIZE,
+                           STATUS_UPDATE_WRITE_BEHIND,
+                           NDJSON_MIMETYPE,
+                           )
+
+
+# the group_stats collection was built, see group_stats_built
+_group_stats_built = False
+# the daily_status_counts collection was built, see daily_counts_built
+_daily_counts_built = False
+
+
+def to_json(obj):
+    """Serialize to compact JSON the same as Flask app.json.dumps."""
+    return json.dumps(obj,
+                      default=MongoJSONProvider.default,
+                      ensure_ascii=True,
+                      sort_keys=True,
+                      separators=(',', ':'),
+                      )
+
+
+def jsonify(obj, status_code=200, headers=None):
+    """Return a JSON response the same as Flask jsonify."""
+    return Response(f"{to_json(obj)}\n",
+                    status_code=status_code,
+                    headers=headers,
+                    media_type='application/json',
+                    )
+
+
+async def group_stats_built():
+    """
+    Check if the group_stats collection holds the counts of all groups.
+
+    See models.group_stats.group_stats_built, the result is cached by
+    the worker once the marker document was found.
+
+    Returns:
+        bool: True if the counts can be read from group_stats.
+    """
+    global _group_stats_built
+    if not _group_stats_built:
+        marker = await group_stats_collection.find_one(
+            {'_id': BUILT_MARKER_ID},
+            )
+        _group_stats_built = marker is not None
+    return _group_stats_built
+
+
+async def daily_counts_built():
+    """
+    Check if the daily_status_counts collection holds the counts of all
+    days.
+
+    See models.daily_counts.daily_counts_built, the result is cached by
+    the worker once the marker document was found.
+
+    Returns:
+        bool: True if /statistics can sum the daily counts.
+    """
+    global _daily_counts_built
+    if not _daily_counts_built:
+        marker = await daily_counts_collection.find_one(
+            {'_id': DAILY_COUNTS_BUILT},
+            )
+        _daily_counts_built = marker is not None
+    return _daily_counts_built
+
+
+def get_args(request):
+    """Return query parameters, the first value wins as in Flask."""
+    return MultiDict(request.query_params.multi_items())
+
+
+def get_accept_mimetypes(request):
+    """Return parsed Accept header as Flask request.accept_mimetypes."""
+    return parse_accept_header(request.headers.get('accept'), MIMEAccept)
+
+
+async def get_json(request):
+    """
+    Read the JSON body of the request as Flask request.get_json does.
+
+    Raises:
+        UnsupportedMediaType: If the request is not of JSON content type.
+        BadRequest: If the body is not valid JSON.
+    """
+    mimetype = request.headers.get('content-type', '').split(';')[0]
+    mimetype = mimetype.strip().lower()
+    if not (mimetype == 'application/json'
+            or (mimetype.startswith('application/')
+                and mimetype.endswith('+json'))):
+        raise UnsupportedMediaType(
+            "Did not attempt to load JSON data because the request"
+            " Content-Type was not 'application/json'."
+            )
+    try:
+        return json.loads(await request.body())
+    except ValueError as err:
+        raise BadRequest() from err
+
+
+async def get_groups_with_images(request):
+    """GET /groups, see app/views.py get_groups_with_images."""
+    args = get_args(request)
+    status_filter = args.get('status')
+    cursor = args.get('cursor')
+    stream = args.get('stream') in ('1', 'true')
+
+    if status_filter and escape(status_filter) not in VALID_STATUSES:
+        return jsonify({
+            "code": 400,
+            "name": "Invalid status",
+            "description": (f"Valid statuses are - {VALID_STATUSES}"),
+            }, 400)
+
+    try:
+        params = parse_groups_params(args)
+    except ValueError as err:
+        return jsonify({
+            "code": 400,
+            "name": "Invalid values of query parameters",
+            "description": str(err),
+            }, 400)
+
+    limit = params['limit']
+    if params['images_per_group'] is not None:
+        params['count_from_group_stats'] = await group_stats_built()
+    pipeline = groups_pipeline(status_filter=status_filter, **params)
+
+    ndjson = prefers_ndjson(get_accept_mimetypes(request))
+    if stream or ndjson:
+        return await get_groups_streaming_response(pipeline,
+                                                   cursor is not None,
+                                                   limit,
+                                                   ndjson=ndjson,
+                                                   )
+
+    if RAW_BSON_RESPONSES:
+        return await get_groups_raw_response(pipeline,
+                                             cursor is not None,
+                                             limit,
+                                             )
+
+    groups = await groups_collection.aggregate(pipeline).to_list(None)
+
+    if cursor is not None:
+        next_cursor = (encode_cursor(groups[-1]) if len(groups) == limit
+                       else None)
+        return jsonify({
+            'groups': groups,
+            'next_cursor': next_cursor,
+            })
+
+    return jsonify(groups)
+
+
+async def get_groups_raw_response(pipeline, with_cursor, limit):
+    """
+    Return the /groups response transcoded straight from raw BSON.
+
+    Args:
+        pipeline (list): Groups aggregation pipeline.
+        with_cursor (bool): Wrap groups with next_cursor (cursor mode).
+        limit (int | None): Number of groups on the page.
+
+    Returns:
+        A JSON response with the list of groups.
+    """
+    batches = await groups_collection.aggregate_raw_batches(
+        pipeline
+        ).to_list(None)
+    documents = list(iter_raw_documents(batches))
+    body = '[' + ','.join(map(document_to_json, documents)) + ']'
+
+    if with_cursor:
+        next_cursor = None
+        if len(documents) == limit:
+            next_cursor = encode_cursor(RawBSONDocument(documents[-1]))
+        body = (f'{{"groups":{body},'
+                f'"next_cursor":{json.dumps(next_cursor)}}}')
+
+    return Response(f"{body}\n", media_type='application/json')
+
+
+async def iter_group_batches(pipeline):
+    """
+    Fetch groups of the pipeline from MongoDB batch by batch.
+
+    Args:
+        pipeline (list): Groups aggregation pipeline.
+
+    Yields:
+        list: Up to STREAM_BATCH_SIZE groups, raw BSON documents if
+        RAW_BSON_RESPONSES is enabled.
+    """
+    if RAW_BSON_RESPONSES:
+        cursor = groups_collection.aggregate_raw_batches(
+            pipeline,
+            batchSize=STREAM_BATCH_SIZE,
+            )
+        while batches := await cursor.to_list(1):
+            batch = list(iter_raw_documents(batches))
+            if batch:
+                yield batch
+        return
+
+    cursor = groups_collection.aggregate(pipeline,
+                                         batchSize=STREAM_BATCH_SIZE,
+                                         )
+    while batch := await cursor.to_list(STREAM_BATCH_SIZE):
+        yield batch
+
+
+async def get_groups_streaming_response(pipeline, with_cursor, limit,
+                                        ndjson=False):
+    """
+    Return the /groups response streamed while the cursor is iterated.
+
+    Args:
+        pipeline (list): Groups aggregation pipeline.
+        with_cursor (bool): Add next_cursor to the response (cursor mode).
+        limit (int | None): Number of groups on the page.
+        ndjson (bool): Write one group per line (JSON Lines)
+            instead of a JSON array.
+
+    Returns:
+        A chunked JSON or NDJSON response with the list of groups.
+    """
+    document_json = document_to_json if RAW_BSON_RESPONSES else to_json
+
+    def get_next_cursor(count, last):
+        if count != limit:
+            return None
+        if RAW_BSON_RESPONSES:
+            last = RawBSONDocument(last)
+        return encode_cursor(last)
+
+    async def iter_all(first_batch, batches):
+        if first_batch is not None:
+            yield first_batch
+            async for batch in batches:
+                yield batch
+
+    async def generate(first_batch, batches):
+        count, last = 0, None
+        separator = '['
+        if with_cursor and not ndjson:
+            yield '{"groups":'
+        async for batch in iter_all(first_batch, batches):
+            count += len(batch)
+            last = batch[-1]
+            if ndjson:
+                yield ''.join(iter_json_lines(batch, document_json))
+            else:
+                yield separator + ','.join(map(document_json, batch))
+                separator = ','
+
+        next_cursor = json.dumps(get_next_cursor(count, last))
+        if ndjson:
+            if with_cursor:
+                yield f'{{"next_cursor":{next_cursor}}}\n'
+            return
+        yield ']' if separator == ',' else '[]'
+        yield f',"next_cursor":{next_cursor}}}\n' if with_cursor else '\n'
+
+    # run the aggregation before the response starts, so its errors
+    # are returned as errors as by the Flask application
+    batches = iter_group_batches(pipeline)
+    first_batch = await anext(batches, None)
+
+    media_type = NDJSON_MIMETYPE if ndjson else 'application/json'
+    return StreamingResponse(generate(first_batch, batches),
+                             media_type=media_type,
+                             )
+
+
+async def update_image_status(request):
+    """PUT /images/<image_id>, see app/views.py update_image_status."""
+    try:
+        image_id = ObjectId(request.path_params['image_id'])
+    except InvalidId as err:
+        # object id is in wrong format
+        return jsonify({
+            "code": 400,
+            "name": "Invalid ObjectId",
+            "description": str(err),
+        }, 400)
+
+    data = await get_json(request)
+    new_status = data.get('status')
+    if new_status not in VALID_STATUSES:
+        return jsonify({
+            "code": 400,
+            "name": "Invalid status",
+            "description": (f"Valid statuses are - {VALID_STATUSES}"),
+            }, 400)
+
+    if_match = parse_etags(request.headers.get('if-match'))
+
+    # the queue is written by a thread of the sync driver, see
+    # models/write_behind.py
+    if STATUS_UPDATE_WRITE_BEHIND and not if_match:
+        status_update_queue.put(image_id, new_status)
+        return jsonify({
+            'message': 'Image status update queued'
+            }, 202)
+
+    image_filter, update = status_update_query(image_id, new_status, if_match)
+
+    async def write(session):
+        image = await images_collection.find_one_and_update(
+            image_filter,
+            update,
+            projection=STATUS_UPDATE_PROJECTION,
+            return_document=ReturnDocument.BEFORE,
+            session=session,
+            )
+        if image:
+            await group_stats_collection.update_one(
+                {'_id': image['group_id']},
+                group_stats_move(image['status'], new_status),
+                session=session,
+                )
+            await daily_counts_collection.bulk_write(
+                daily_counts_operations([(image['created_at'],
+                                          image['status'],
+                                          new_status,
+                                          1,
+                                          )]),
+                ordered=False,
+                session=session,
+                )
+        return image
+
+    try:
+        # a queued update of the image is older, write it first
+        await asyncio.to_thread(status_update_queue.flush, [image_id])
+        generation = statistics_cache.begin_write()
+        # the image and its counts are updated together or not at all
+        image = await run_in_transaction(write)
+        if image:
+            move_image_in_statistics_cache(image, new_status, generation)
+            body, status_code, etag = updated_result(image)
+        else:
+            # nothing was updated, find out why
+            image = await images_collection.find_one(
+                {'_id': image_id},
+                CURRENT_VERSION_PROJECTION,
+                )
+            body, status_code, etag = not_updated_result(image, if_match)
+        headers = {'ETag': quote_etag(etag)} if etag is not None else None
+        return jsonify(body, status_code, headers)
+
+    except Exception as err:
+        return jsonify({
+                "code": 500,
+                "name": "MongoDB exeption occured",
+                "description": str(err),
+            }, 500)
+
+
+async def get_statistics(request):
+    """GET /statistics, see app/views.py get_statistics."""
+    return await get_statistics_response(request,
+                                         get_args(request).get('group_id'),
+                                         )
+
+
+async def get_group_statistics(request):
+    """GET /groups/<group_id>/statistics, see app/views.py."""
+    return await get_statistics_response(request,
+                                         request.path_params['group_id'],
+                                         )
+
+
+async def get_statistics_response(request, group_id):
+    """
+    Build the response of /statistics, of all images or of one group.
+
+    Args:
+        request (starlette.requests.Request): The request.
+        group_id (str | None): Group to count images of, in ObjectId format.
+
+    Returns:
+        Response of /statistics or a 400 Bad Request response.
+    """
+    if group_id is not None:
+        try:
+            group_id = ObjectId(group_id)
+        except InvalidId as err:
+            # object id is in wrong format
+            return jsonify({
+                "code": 400,
+                "name": "Invalid ObjectId",
+                "description": str(err),
+            }, 400)
+
+    try:
+        params = parse_statistics_params(get_args(request))
+    except ValueError as err:
+        return jsonify({
+            "code": 400,
+            "name": "Invalid values of query parameters",
+            "description": str(err),
+            }, 400)
+    bucket = params['bucket']
+    start_date, end_date = params['start_date'], params['end_date']
+
+    key = (group_id, *params['key'])
+    cached = statistics_cache.get(key)
+    if cached is not None:
+        start_date, end_date, value = cached
+    else:
+        generation = statistics_cache.begin_read()
+        use_daily_counts, pipeline, options = statistics_query(
+            start_date,
+            end_date,
+            bucket,
+            group_id,
+            await daily_counts_built(),
+            )
+        collection = (daily_counts_collection if use_daily_counts
+                      else images_collection)
+        items = await collection.aggregate(pipeline, **options).to_list(None)
+        if bucket:
+            value = items
+        else:
+            value = {item['_id']: item['count'] for item in items}
+        # a group without images in the period may not exist at all
+        if (not value and group_id is not None
+                and not await groups_collection.count_documents(
+                    {'_id': group_id},
+                    limit=1,
+                    )):
+            return jsonify({
+                "code": 400,
+                "name": "Group not found",
+                "description": "Specified ID was not found in database",
+                }, 400)
+        statistics_cache.put(key, start_date, end_date, bucket, value,
+                             group_id,
+                             generation,
+                             )
+
+    ndjson = prefers_ndjson(get_accept_mimetypes(request))
+    if bucket:
+        if ndjson:
+            return Response(''.join(iter_json_lines(value, to_json)),
+                            media_type=NDJSON_MIMETYPE,
+                            )
+        return jsonify({
+            'bucket': bucket,
+            'from': start_date,
+            'to': end_date,
+            'series': value,
+            })
+
+    if ndjson:
+        lines = iter_json_lines(({'status': status, 'count': count}
+                                 for status, count in value.items()),
+                                to_json,
+                                )
+        return Response(''.join(lines), media_type=NDJSON_MIMETYPE)
+
+    return jsonify(value)
+
+
+def error_response(e, headers=None):
+    """
+    Return the JSON error response of an HTTP exception.
+
+    The body is the same as the Flask 'handle_exception' error handler
+    returns, see app/views.py.
+
+    Args:
+        e (werkzeug.exceptions.HTTPException): The HTTP exception.
+        headers (Mapping | None): Headers of the response, e.g. Allow.
+
+    Returns:
+        A JSON response with code, name and description of the error.
+    """
+    return Response(json.dumps({
+                        "code": e.code,
+                        "name": e.name,
+                        "description": e.description,
+                    }),
+                    status_code=e.code,
+                    headers=headers,
+                    media_type='application/json',
+                    )
+
+
+async def handle_exception(request, exc):
+    """Error handler of werkzeug HTTP exceptions (e.g. invalid JSON)."""
+    return error_response(exc)
+
+
+async def handle_starlette_exception(request, exc):
+    """Error handler of routing errors, such as 404 and 405."""
+    error = default_exceptions.get(exc.status_code, InternalServerError)
+    return error_response(error(), exc.headers)
+
+
+async def handle_error(request, exc):
+    """Error handler of unexpected errors, returns 500 as Flask does."""
+    return error_response(InternalServerError())
+
+
+exception_handlers = {
+    HTTPException: handle_exception,
+    StarletteHTTPException: handle_starlette_exception,
+    Exception: handle_error,
+}
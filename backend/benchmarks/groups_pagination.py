@@ -0,0 +1,114 @@
+"""
+Benchmark of the /groups pipeline pagination
+
+Fills a separate benchmark database with growing numbers of groups and
+measures how long it takes to aggregate the first, a middle and the last
+page of groups with 'models.pipelines.groups_pipeline', by page number and
+by cursor. As the page of groups is selected before the images are joined,
+the cursor timings stay flat while the collection grows.
+
+Usage (from the backend directory, MONGODB_URI set in .env):
+    python -m benchmarks.groups_pagination [number_of_groups ...]
+
+The benchmark database is '<MONGODB_DB_NAME>_benchmark', it is dropped
+at the end of the run.
+"""
+
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from pymongo import MongoClient
+from config.config import (MONGODB_URI,
+                           MONGODB_DB_NAME,
+                           MONGODB_IMAGE_COLLECTION_NAME,
+                           MONGODB_GROUPS_COLLECTION_NAME,
+                           VALID_STATUSES,
+                           )
+from models.pipelines import groups_pipeline
+
+GROUP_SIZES = [1_000, 10_000, 100_000]
+IMAGES_PER_GROUP = 10
+GROUPS_PER_PAGE = 20
+REPEATS = 5
+
+
+def fill(db, number_of_groups):
+    """Recreate the collections with number_of_groups groups of images."""
+    db.drop_collection(MONGODB_GROUPS_COLLECTION_NAME)
+    db.drop_collection(MONGODB_IMAGE_COLLECTION_NAME)
+    groups = db[MONGODB_GROUPS_COLLECTION_NAME]
+    images = db[MONGODB_IMAGE_COLLECTION_NAME]
+    groups.create_index([("name", 1), ("_id", 1)])
+    images.create_index([("group_id", 1),
+                         ("status", 1),
+                         ("last_updated_at", -1),
+                         ])
+
+    now = datetime.utcnow()
+    group_ids = groups.insert_many(
+        [{'name': f"Group {number:07}"} for number in range(number_of_groups)]
+        ).inserted_ids
+    batch = []
+    for group_id in group_ids:
+        for number in range(IMAGES_PER_GROUP):
+            created_at = now - timedelta(minutes=number)
+            batch.append({
+                'created_at': created_at,
+                'last_updated_at': created_at,
+                'url': f"https://images_service.com/{group_id}/{number}.png",
+                'status': VALID_STATUSES[number % len(VALID_STATUSES)],
+                'group_id': group_id,
+            })
+        if len(batch) >= 10_000:
+            images.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        images.insert_many(batch, ordered=False)
+
+
+def measure(collection, pipeline):
+    """Return median time of the aggregation in milliseconds."""
+    timings = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        list(collection.aggregate(pipeline))
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def run(group_sizes):
+    client = MongoClient(MONGODB_URI)
+    db = client[f"{MONGODB_DB_NAME}_benchmark"]
+    groups = db[MONGODB_GROUPS_COLLECTION_NAME]
+
+    print(f"{'groups':>10} {'page':>8} {'by page, ms':>12} "
+          f"{'by cursor, ms':>14}")
+    try:
+        for number_of_groups in group_sizes:
+            fill(db, number_of_groups)
+            last_page = number_of_groups // GROUPS_PER_PAGE - 1
+            for page in (0, last_page // 2, last_page):
+                by_page = measure(groups, groups_pipeline(
+                    skip=page * GROUPS_PER_PAGE,
+                    limit=GROUPS_PER_PAGE,
+                    ))
+                # the cursor of a page is the last group of the previous one
+                after = None
+                if page:
+                    previous = groups.find({}, {'name': 1}).sort(
+                        [('name', 1), ('_id', 1)]
+                        ).skip(page * GROUPS_PER_PAGE - 1).limit(1).next()
+                    after = (previous['name'], previous['_id'])
+                by_cursor = measure(groups, groups_pipeline(
+                    after=after,
+                    limit=GROUPS_PER_PAGE,
+                    ))
+                print(f"{number_of_groups:>10} {page:>8} {by_page:>12.2f} "
+                      f"{by_cursor:>14.2f}")
+    finally:
+        client.drop_database(db.name)
+
+
+if __name__ == "__main__":
+    run([int(size) for size in sys.argv[1:]] or GROUP_SIZES)
@@ -0,0 +1,85 @@
+"""
+Microbenchmark of /groups response serialization
+
+Compares the former serialization path of the endpoints,
+'jsonify(sanitize_json(data))' (extended JSON dump, load back and dump again),
+with the single pass 'MongoJSONProvider' on a /groups payload
+of 10 000 images. No database is needed.
+
+Usage (from the backend directory):
+    python -m benchmarks.json_provider
+"""
+
+import statistics
+import time
+from datetime import datetime, timedelta
+from bson import ObjectId
+from flask import Flask
+from config.config import VALID_STATUSES
+from utils.utils import sanitize_json, MongoJSONProvider
+
+NUMBER_OF_GROUPS = 250
+IMAGES_PER_GROUP = 40
+REPEATS = 20
+
+
+def make_groups():
+    """Build a /groups payload as it comes from pymongo."""
+    now = datetime.utcnow()
+    groups = []
+    for group_number in range(NUMBER_OF_GROUPS):
+        group_id = ObjectId()
+        images = []
+        for image_number in range(IMAGES_PER_GROUP):
+            created_at = now - timedelta(minutes=image_number)
+            images.append({
+                '_id': ObjectId(),
+                'created_at': created_at,
+                'last_updated_at': created_at,
+                'status': VALID_STATUSES[image_number % len(VALID_STATUSES)],
+                'url': (f"https://images_service.com/output/"
+                        f"group_{group_number}_image_{image_number}.png"),
+            })
+        groups.append({
+            '_id': group_id,
+            'name': f"Group {group_number}",
+            'images': images,
+            'count': len(images),
+        })
+    return groups
+
+
+def measure(function):
+    """Return median time of the function call in milliseconds."""
+    timings = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def run():
+    groups = make_groups()
+    default_app = Flask('default')
+    mongo_app = Flask('mongo')
+    mongo_app.json = MongoJSONProvider(mongo_app)
+
+    def sanitize_json_path():
+        return default_app.json.dumps(sanitize_json(groups))
+
+    def provider_path():
+        return mongo_app.json.dumps(groups)
+
+    with default_app.app_context(), mongo_app.app_context():
+        assert sanitize_json_path() == provider_path(), "wire format differs"
+        old = measure(sanitize_json_path)
+        new = measure(provider_path)
+
+    print(f"{NUMBER_OF_GROUPS * IMAGES_PER_GROUP} images")
+    print(f"sanitize_json + jsonify: {old:8.2f} ms")
+    print(f"MongoJSONProvider:       {new:8.2f} ms ({old / new:.1f}x)")
+
+
+if __name__ == "__main__":
+    run()
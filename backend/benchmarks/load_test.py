@@ -0,0 +1,129 @@
+"""
+Load test of the sync (gunicorn) and the async (uvicorn) service
+
+Sends GET /groups and GET /statistics requests from a growing number of
+concurrent keep-alive connections to every given server and reports the
+throughput, latency percentiles and errors at each concurrency level, so
+the concurrency the Flask application (one request per gunicorn thread)
+and the ASGI application (asgi_app, Motor) sustain can be compared on the
+same database.
+
+Usage (from the backend directory, servers already running):
+    gunicorn --config gunicorn_config.py app:app
+    uvicorn asgi_app:app --port 8000 --workers 2
+    python -m benchmarks.load_test http://127.0.0.1:5000 \\
+        http://127.0.0.1:8000 [seconds]
+
+Run the client on another machine than the servers or make sure it does
+not saturate a CPU, it is a single asyncio process.
+"""
+
+import asyncio
+import statistics
+import sys
+import time
+from urllib.parse import urlsplit
+
+CONCURRENCY = [4, 16, 64, 256]
+DURATION = 10
+PATHS = [
+    '/groups?cursor=&groups_per_page=10&images_per_group=10',
+    '/statistics',
+    '/statistics?days=7&bucket=day',
+]
+
+
+async def read_response(reader):
+    """Read one HTTP/1.1 response, return its status and headers."""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("Connection closed by the server")
+    status = int(status_line.split()[1])
+    headers = {}
+    while (line := await reader.readline()) not in (b'\r\n', b''):
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    if 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    elif headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            # chunk data and its CRLF, the last chunk is only CRLF
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    return status, headers
+
+
+async def client(host, port, deadline, latencies, errors, number):
+    """Send requests over one keep-alive connection until the deadline."""
+    reader = writer = None
+    request = 0
+    while time.perf_counter() < deadline:
+        path = PATHS[(number + request) % len(PATHS)]
+        request += 1
+        start = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            writer.write(f"GET {path} HTTP/1.1\r\n"
+                         f"Host: {host}:{port}\r\n"
+                         "Connection: keep-alive\r\n\r\n".encode())
+            status, headers = await read_response(reader)
+        except (OSError, ValueError, asyncio.IncompleteReadError):
+            errors.append(None)
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+            continue
+        latencies.append(time.perf_counter() - start)
+        if status >= 400:
+            errors.append(status)
+        if headers.get('connection', '').lower() == 'close':
+            writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def measure(url, concurrency, duration):
+    """Load the server with concurrent clients for duration seconds."""
+    parts = urlsplit(url)
+    latencies, errors = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        client(parts.hostname, parts.port or 80, start + duration,
+               latencies, errors, number)
+        for number in range(concurrency)
+        ))
+    elapsed = time.perf_counter() - start
+
+    if len(latencies) > 1:
+        percentiles = statistics.quantiles(latencies, n=100)
+        p50, p99 = percentiles[49] * 1000, percentiles[98] * 1000
+    else:
+        p50 = p99 = float('nan')
+    return len(latencies) / elapsed, p50, p99, len(errors)
+
+
+def run(urls, duration):
+    print(f"{'server':<28} {'concurrency':>11} {'requests/s':>11} "
+          f"{'p50, ms':>9} {'p99, ms':>9} {'errors':>7}")
+    for url in urls:
+        for concurrency in CONCURRENCY:
+            rate, p50, p99, errors = asyncio.run(
+                measure(url, concurrency, duration)
+                )
+            print(f"{url:<28} {concurrency:>11} {rate:>11.1f} "
+                  f"{p50:>9.2f} {p99:>9.2f} {errors:>7}")
+
+
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    duration = DURATION
+    if arguments and arguments[-1].isdigit():
+        duration = int(arguments.pop())
+    run(arguments or ['http://127.0.0.1:5000', 'http://127.0.0.1:8000'],
+        duration,
+        )
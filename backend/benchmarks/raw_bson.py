@@ -0,0 +1,89 @@
+"""
+Microbenchmark of the RAW_BSON_RESPONSES /groups serialization
+
+Compares the default path of the endpoint, BSON decoded into Python dicts
+by pymongo and serialized by 'MongoJSONProvider', with the raw BSON to
+JSON transcoder (utils/raw_bson.py) on the same aggregation batch of
+/groups, 500 groups of 40 images. Both start from the BSON bytes MongoDB
+returns. No database is needed.
+
+Usage (from the backend directory):
+    python -m benchmarks.raw_bson
+"""
+
+import statistics
+import time
+from datetime import datetime, timedelta
+import bson
+from bson import ObjectId
+from flask import Flask
+from config.config import VALID_STATUSES
+from utils.utils import MongoJSONProvider
+from utils.raw_bson import iter_raw_documents, document_to_json
+
+NUMBER_OF_GROUPS = 500
+IMAGES_PER_GROUP = 40
+REPEATS = 20
+
+
+def make_batch():
+    """Build a /groups aggregation batch as MongoDB returns it."""
+    now = datetime.utcnow().replace(microsecond=276000)
+    documents = []
+    for group_number in range(NUMBER_OF_GROUPS):
+        images = []
+        for image_number in range(IMAGES_PER_GROUP):
+            created_at = now - timedelta(minutes=image_number)
+            images.append({
+                '_id': ObjectId(),
+                'created_at': created_at,
+                'last_updated_at': created_at,
+                'status': VALID_STATUSES[image_number % len(VALID_STATUSES)],
+                'url': (f"https://images_service.com/output/"
+                        f"group_{group_number}_image_{image_number}.png"),
+            })
+        documents.append({
+            '_id': ObjectId(),
+            'name': f"Group {group_number}",
+            'images': images,
+            'count': len(images),
+        })
+    return b''.join(bson.encode(document) for document in documents)
+
+
+def measure(function):
+    """Return median time of the function call in milliseconds."""
+    timings = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def run():
+    batch = make_batch()
+    app = Flask('mongo')
+    app.json = MongoJSONProvider(app)
+
+    def decoded_path():
+        return '[' + ','.join(app.json.dumps(document, separators=(',', ':'))
+                              for document in bson.decode_all(batch)) + ']'
+
+    def raw_path():
+        return '[' + ','.join(map(document_to_json,
+                                  iter_raw_documents([batch]))) + ']'
+
+    with app.app_context():
+        assert decoded_path() == raw_path(), "wire format differs"
+        old = measure(decoded_path)
+        new = measure(raw_path)
+
+    print(f"{NUMBER_OF_GROUPS * IMAGES_PER_GROUP} images, "
+          f"{len(batch) / 1e6:.1f} MB of BSON")
+    print(f"decode + MongoJSONProvider: {old:8.2f} ms")
+    print(f"raw BSON transcoder:        {new:8.2f} ms ({old / new:.1f}x)")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,118 @@
+"""
+Benchmark of the /statistics histogram pipelines
+
+Fills a separate benchmark database with images created evenly over
+the last year and measures a 365 day daily histogram and 30 day totals,
+counted over images with 'models.pipelines.statistics_pipeline' (covered
+by the (created_at, status) index) and summed from daily counts with
+'models.pipelines.daily_counts_pipeline'.
+
+Usage (from the backend directory, MONGODB_URI set in .env):
+    python -m benchmarks.statistics_histogram [number_of_images]
+
+The benchmark database is '<MONGODB_DB_NAME>_benchmark', it is dropped
+at the end of the run.
+"""
+
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from pymongo import MongoClient
+from config.config import (MONGODB_URI,
+                           MONGODB_DB_NAME,
+                           MONGODB_IMAGE_COLLECTION_NAME,
+                           MONGODB_DAILY_COUNTS_COLLECTION_NAME,
+                           VALID_STATUSES,
+                           )
+from models.pipelines import statistics_pipeline, daily_counts_pipeline
+
+NUMBER_OF_IMAGES = 1_000_000
+DAYS = 365
+REPEATS = 5
+
+
+def fill(db, number_of_images, today):
+    """Recreate images of the last DAYS days and their daily counts."""
+    db.drop_collection(MONGODB_IMAGE_COLLECTION_NAME)
+    images = db[MONGODB_IMAGE_COLLECTION_NAME]
+    images.create_index([("created_at", 1), ("status", 1)])
+
+    step = timedelta(days=DAYS) / number_of_images
+    batch = []
+    for number in range(number_of_images):
+        batch.append({
+            'created_at': today - step * number,
+            'status': VALID_STATUSES[number % len(VALID_STATUSES)],
+        })
+        if len(batch) >= 10_000:
+            images.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        images.insert_many(batch, ordered=False)
+
+    images.aggregate([
+        {
+            '$group': {
+                '_id': {
+                    'day': {'$dateTrunc': {'date': '$created_at',
+                                           'unit': 'day',
+                                           }},
+                    'status': '$status',
+                },
+                'count': {'$sum': 1},
+            }
+        },
+        {
+            '$project': {
+                '_id': 0,
+                'day': '$_id.day',
+                'status': '$_id.status',
+                'count': 1,
+            }
+        },
+        {'$out': MONGODB_DAILY_COUNTS_COLLECTION_NAME},
+    ])
+    db[MONGODB_DAILY_COUNTS_COLLECTION_NAME].create_index(
+        [("day", 1), ("status", 1)], unique=True,
+        )
+
+
+def measure(collection, pipeline):
+    """Return median time of the aggregation in milliseconds."""
+    timings = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        list(collection.aggregate(pipeline))
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def run(number_of_images):
+    client = MongoClient(MONGODB_URI)
+    db = client[f"{MONGODB_DB_NAME}_benchmark"]
+    images = db[MONGODB_IMAGE_COLLECTION_NAME]
+    daily_counts = db[MONGODB_DAILY_COUNTS_COLLECTION_NAME]
+
+    now = datetime.utcnow()
+    end = datetime(now.year, now.month, now.day) + timedelta(days=1)
+    year, month = end - timedelta(days=DAYS), end - timedelta(days=30)
+    try:
+        fill(db, number_of_images, now)
+        print(f"{number_of_images} images")
+        print(f"{'query':<24} {'images, ms':>12} {'daily counts, ms':>18}")
+        for name, start, bucket in (("365 days, bucket=day", year, 'day'),
+                                    ("365 days, bucket=week", year, 'week'),
+                                    ("30 days totals", month, None),
+                                    ):
+            counted = measure(images,
+                              statistics_pipeline(start, end, bucket))
+            summed = measure(daily_counts,
+                             daily_counts_pipeline(start, end, bucket))
+            print(f"{name:<24} {counted:>12.2f} {summed:>18.2f}")
+    finally:
+        client.drop_database(db.name)
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else NUMBER_OF_IMAGES)
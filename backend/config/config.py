@@ -11,14 +11,64 @@ MONGODB_IMAGE_COLLECTION_NAME = os.environ.get('MONGODB_IMAGE_COLLECTION_NAME')
 MONGODB_GROUPS_COLLECTION_NAME = os.environ.get(
                                             'MONGODB_GROUPS_COLLECTION_NAME'
                                             )
+MONGODB_GROUP_STATS_COLLECTION_NAME = os.environ.get(
+                                    'MONGODB_GROUP_STATS_COLLECTION_NAME',
+                                    'group_stats',
+                                    )
+MONGODB_DAILY_COUNTS_COLLECTION_NAME = os.environ.get(
+                                    'MONGODB_DAILY_COUNTS_COLLECTION_NAME',
+                                    'daily_status_counts',
+                                    )
 
 # config flask app
 FLASK_DEBUG = False
 FLASK_HOST = "127.0.0.1" if FLASK_DEBUG else "0.0.0.0"
 
+# write /groups responses straight from raw BSON returned by MongoDB
+# without decoding it into python dicts
+RAW_BSON_RESPONSES = os.environ.get('RAW_BSON_RESPONSES', '') in ('1', 'true')
+
+# number of documents fetched from MongoDB and written to
+# a streaming response at once
+STREAM_BATCH_SIZE = int(os.environ.get('STREAM_BATCH_SIZE', '100'))
+
+# JSON Lines responses are returned if requested with Accept header
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
 # constants
 VALID_STATUSES = ['new', 'review', 'accepted', 'deleted']
 STATISTIC_NUMBER_OF_DAYS = 30
+# longest period of /statistics given by days, ten years
+STATISTIC_MAX_NUMBER_OF_DAYS = 3660
+# 'rollup' - sum pre-aggregated daily_status_counts documents
+# 'images' - count images of the period with an aggregation
+STATISTICS_ENGINE = os.environ.get('STATISTICS_ENGINE', 'rollup')
+# time buckets of /statistics histograms, weeks start on monday
+STATISTICS_BUCKETS = ['hour', 'day', 'week']
+
+# maximum number of images of a group returned by /groups
+# with images_per_group
+MAX_IMAGES_PER_GROUP = 10000
+
+# maximum number of images updated by one PATCH /images request
+BULK_UPDATE_MAX_ITEMS = 10000
+
+# acknowledge PUT /images/<image_id> at once and write status updates
+# in background, coalesced, every STATUS_UPDATE_FLUSH_INTERVAL seconds
+STATUS_UPDATE_WRITE_BEHIND = os.environ.get('STATUS_UPDATE_WRITE_BEHIND',
+                                            '') in ('1', 'true')
+STATUS_UPDATE_FLUSH_INTERVAL = float(os.environ.get(
+                                            'STATUS_UPDATE_FLUSH_INTERVAL',
+                                            '0.2',
+                                            ))
+
+# image fields which can be requested in /groups with fields parameter
+# '_id' is always returned
+IMAGE_FIELDS = ['_id', 'created_at', 'group_id', 'last_updated_at',
+                'status', 'url', 'version']
+# group_id is the same as _id of the parent group so skip it by default
+DEFAULT_IMAGE_FIELDS = ['_id', 'created_at', 'last_updated_at',
+                        'status', 'url']
 
 # pagination constants
 #
@@ -26,3 +76,20 @@ STATISTIC_NUMBER_OF_DAYS = 30
 # so we will have both pagination and ability
 # to access any particualr group
 DEFAULT_PAGINATION_NUMBER_OF_GROUPS_TO_RETURN = 1
+
+# MongoDB connections of an ASGI worker (asgi_app), one event loop serves
+# all requests of the worker so it needs as many as concurrent queries
+MONGODB_ASYNC_MAX_POOL_SIZE = int(os.environ.get('MONGODB_ASYNC_MAX_POOL_SIZE',
+                                                 '100',
+                                                 ))
+
+# seconds the connection warm-up of a worker may take (models/warmup.py),
+# it runs before the worker heartbeats to gunicorn, so keep it well under
+# the gunicorn worker timeout (30 seconds)
+MONGODB_WARM_UP_TIMEOUT = float(os.environ.get('MONGODB_WARM_UP_TIMEOUT',
+                                               '5',
+                                               ))
+
+# seconds /statistics results are kept per worker, 0 disables the cache
+STATISTICS_CACHE_TTL = float(os.environ.get('STATISTICS_CACHE_TTL', '5'))
+STATISTICS_CACHE_MAX_ENTRIES = 128
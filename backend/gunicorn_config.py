@@ -2,8 +2,72 @@ import os
 
 workers = int(os.environ.get('GUNICORN_PROCESSES', '2'))
 threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+# 'gthread' - a request per thread, 'gevent' - a request per greenlet,
+# worker_connections requests per worker at once
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS',
+                                        '1000',
+                                        ))
 # timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
 bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
 
 forwarded_allow_ips = '*'
-secure_scheme_headers = { 'X-Forwarded-Proto': 'https' }
\ No newline at end of file
+secure_scheme_headers = { 'X-Forwarded-Proto': 'https' }
+
+# MongoDB connections of a worker: one for every request thread plus one
+# for the write-behind queue thread, kept open while the worker is idle.
+# A request waits at most this long for a free connection.
+# Total connections are about workers * (threads + 1), plus monitoring.
+mongodb_max_pool_size = threads + 1
+mongodb_min_pool_size = threads
+if worker_class == 'gevent':
+    # greenlets of a worker share at most MONGODB_MAX_POOL_SIZE connections,
+    # the rest of worker_connections requests wait in the queue
+    mongodb_max_pool_size = min(worker_connections,
+                                int(os.environ.get('MONGODB_MAX_POOL_SIZE',
+                                                   '100',
+                                                   )),
+                                ) + 1
+    mongodb_min_pool_size = max(1, mongodb_max_pool_size // 10)
+mongodb_wait_queue_timeout_ms = int(os.environ.get(
+                                        'MONGODB_WAIT_QUEUE_TIMEOUT_MS',
+                                        '5000',
+                                        ))
+
+
+def post_fork(server, worker):
+    if worker_class == 'gevent':
+        # the gevent worker patches only after this hook, but pymongo
+        # (imported by models.models below) keeps the ssl and threading
+        # classes it imports, so patch before it is imported
+        from gevent import monkey
+        monkey.patch_all()
+
+    # size the MongoClient pool of the worker before it is created lazily
+    from models.models import configure_client
+    configure_client(maxPoolSize=mongodb_max_pool_size,
+                     minPoolSize=mongodb_min_pool_size,
+                     waitQueueTimeoutMS=mongodb_wait_queue_timeout_ms,
+                     )
+    # connect before the worker accepts requests, a failed warm-up
+    # leaves the worker not ready (/healthz/ready) but running, it gives
+    # up after MONGODB_WARM_UP_TIMEOUT seconds, before gunicorn kills
+    # the worker for a missed heartbeat
+    from models.warmup import warm_up
+    try:
+        report = warm_up()
+    except Exception:
+        server.log.exception("Worker %s MongoDB warm-up failed", worker.pid)
+    else:
+        server.log.info("Worker %s MongoDB warm-up took %.1f ms "
+                        "(%d connections, ping %.1f ms, queries %.1f ms)",
+                        worker.pid, report['total_ms'],
+                        report['connections'], report['ping_ms'],
+                        report['queries_ms'],
+                        )
+
+
+def worker_exit(server, worker):
+    # write status updates still waiting in the write-behind queue
+    from models.write_behind import status_update_queue
+    status_update_queue.drain()
@@ -0,0 +1,165 @@
+"""
+Daily Image Status Counts
+
+The 'daily_status_counts' collection holds the number of images created
+on a day in every status, one document per (day, status):
+
+    {"day": ISODate("2023-09-17"), "status": "new", "count": 12}
+
+It is maintained incrementally on image inserts and status changes, so
+/statistics sums at most a few documents per day instead of scanning all
+images of the period. Services inserting images must increment the count
+of the day as well, as createtestdb/imagecreator.py does. To build the
+collection for an existing database or to repair it run
+'flask --app run.py rebuild-daily-counts'. Until then /statistics counts
+the images, see 'daily_counts_built'.
+"""
+
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+from pymongo import UpdateOne, ReplaceOne
+from models.models import db, images_collection, daily_counts_collection
+from models.pipelines import statistics_pipeline, statistics_hint
+from models.indexes import INDEXES
+from config.config import (VALID_STATUSES,
+                           MONGODB_DAILY_COUNTS_COLLECTION_NAME,
+                           )
+
+
+# _id of the document telling that the counts of all days were built,
+# it has no day, so it is never summed
+BUILT_MARKER_ID = 'built'
+# set once this worker saw the marker, the collection stays complete
+_built = threading.Event()
+
+
+def to_day(date):
+    """Return midnight (UTC) of the day of the date."""
+    return datetime(date.year, date.month, date.day)
+
+
+def move_images_in_daily_counts(moves, session=None):
+    """
+    Move images between statuses in the counts of their creation days.
+
+    All moves are written with one bulk write.
+
+    Args:
+        moves (iterable): (created_at, old_status, new_status, number)
+            tuples, number is the number of images moved.
+        session (ClientSession | None): Session of the transaction
+            updating the images.
+    """
+    operations = daily_counts_operations(moves)
+    if operations:
+        daily_counts_collection.bulk_write(operations,
+                                           ordered=False,
+                                           session=session,
+                                           )
+
+
+def daily_counts_operations(moves):
+    """
+    Build the bulk write operations moving images between statuses.
+
+    Moves of the same day and status are summed into one operation.
+
+    Args:
+        moves (iterable): (created_at, old_status, new_status, number)
+            tuples, number is the number of images moved.
+
+    Returns:
+        list: UpdateOne operations of the daily_status_counts collection.
+    """
+    increments = Counter()
+    for created_at, old_status, new_status, number in moves:
+        day = to_day(created_at)
+        increments[(day, old_status)] -= number
+        increments[(day, new_status)] += number
+
+    return [
+        UpdateOne({'day': day, 'status': status},
+                  {'$inc': {'count': number}},
+                  upsert=True,
+                  )
+        for (day, status), number in increments.items() if number
+        ]
+
+
+def daily_counts_built():
+    """
+    Check if the daily_status_counts collection holds the counts of all
+    days.
+
+    The collection is complete once it was built by rebuild_daily_counts,
+    or by the service creating the database, which write the marker
+    document. Status updates before that only add deltas to a partial
+    collection, which the rebuild replaces. The result is cached by the
+    worker from then on.
+
+    Returns:
+        bool: True if /statistics can sum the daily counts.
+    """
+    if not _built.is_set() and daily_counts_collection.count_documents(
+            {'_id': BUILT_MARKER_ID},
+            limit=1,
+            ):
+        _built.set()
+    return _built.is_set()
+
+
+def rebuild_daily_counts(days=None, batch_size=10000):
+    """
+    Recount images per creation day and status.
+
+    Args:
+        days (iterable | None): Days (any datetime of the day) to recount
+            with an aggregation each. If None all images are read in
+            batches of batch_size and the collection is replaced at once
+            and marked as built.
+        batch_size (int): Number of images read from the database at once.
+    """
+    if days is not None:
+        operations = []
+        for day in {to_day(day) for day in days}:
+            counts = dict.fromkeys(VALID_STATUSES, 0)
+            counts.update(
+                (item['_id'], item['count'])
+                for item in images_collection.aggregate(
+                    statistics_pipeline(day, day + timedelta(days=1)),
+                    hint=statistics_hint(),
+                    )
+                )
+            operations.extend(
+                ReplaceOne({'day': day, 'status': status},
+                           {'day': day, 'status': status, 'count': count},
+                           upsert=True,
+                           )
+                for status, count in counts.items()
+                )
+        if operations:
+            daily_counts_collection.bulk_write(operations, ordered=False)
+        return
+
+    counts = Counter()
+    images = images_collection.find(
+        {},
+        {'_id': 0, 'created_at': 1, 'status': 1},
+        batch_size=batch_size,
+        )
+    for image in images:
+        counts[(to_day(image['created_at']), image['status'])] += 1
+
+    # fill a new collection and swap it with the current one at once
+    rebuilt = db[f"{MONGODB_DAILY_COUNTS_COLLECTION_NAME}_rebuild"]
+    rebuilt.drop()
+    rebuilt.create_indexes(INDEXES[MONGODB_DAILY_COUNTS_COLLECTION_NAME])
+    documents = [{'day': day, 'status': status, 'count': count}
+                 for (day, status), count in counts.items()]
+    for start in range(0, len(documents), batch_size):
+        rebuilt.insert_many(documents[start:start + batch_size])
+    rebuilt.insert_one({'_id': BUILT_MARKER_ID,
+                        'built_at': datetime.utcnow(),
+                        })
+    rebuilt.rename(MONGODB_DAILY_COUNTS_COLLECTION_NAME, dropTarget=True)
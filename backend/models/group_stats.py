@@ -0,0 +1,172 @@
+"""
+Per Group Image Counts
+
+The 'group_stats' collection holds one document per group with the total
+number of its images and the number of images in every status:
+
+    {
+        "_id": <group_id>,
+        "total": 10,
+        "counts": {"new": 3, "review": 3, "accepted": 2, "deleted": 2}
+    }
+
+It is maintained incrementally on every status change, in the same
+transaction as the images, so the number of images of a group is read from
+one document instead of being counted over the images collection. Services
+inserting images must increment the counts of the group as well, as
+createtestdb/imagecreator.py does. The collection is built for an existing
+database, or repaired, with 'flask --app run.py rebuild-group-stats'. Until
+then groups are counted over the images collection, see
+'group_stats_built'.
+"""
+
+import threading
+from collections import Counter
+from datetime import datetime
+from models.models import images_collection, group_stats_collection
+from config.config import MONGODB_GROUP_STATS_COLLECTION_NAME
+
+# _id of the document telling that the counts of all groups were built,
+# group ids are ObjectIds so it never matches a group
+BUILT_MARKER_ID = 'built'
+# set once this worker saw the marker, the collection stays complete
+_built = threading.Event()
+
+
+def move_image_in_group_stats(group_id, old_status, new_status, number=1,
+                              session=None):
+    """
+    Move an image from old_status to new_status in the counts of its group.
+
+    Args:
+        group_id (ObjectId): Group of the image.
+        old_status (str): Status of the image before the update.
+        new_status (str): Status of the image after the update.
+        number (int): Number of images moved.
+        session (ClientSession | None): Session of the transaction
+            updating the image.
+    """
+    group_stats_collection.update_one(
+        {'_id': group_id},
+        group_stats_move(old_status, new_status, number),
+        session=session,
+        )
+
+
+def move_images_in_group_stats(group_id, moves, new_status, session=None):
+    """
+    Move images of a group from several statuses to new_status.
+
+    Args:
+        group_id (ObjectId): Group of the images.
+        moves (iterable): (old_status, number) pairs, number is the number
+            of images moved from old_status.
+        new_status (str): Status of the images after the update.
+        session (ClientSession | None): Session of the transaction
+            updating the images.
+    """
+    increments = Counter()
+    for old_status, number in moves:
+        increments[f'counts.{old_status}'] -= number
+        increments[f'counts.{new_status}'] += number
+    increments = {field: number for field, number in increments.items()
+                  if number}
+    if increments:
+        group_stats_collection.update_one({'_id': group_id},
+                                          {'$inc': increments},
+                                          session=session,
+                                          )
+
+
+def group_stats_move(old_status, new_status, number=1):
+    """
+    Build the update of a group_stats document moving images between statuses.
+
+    Args:
+        old_status (str): Status of the images before the update.
+        new_status (str): Status of the images after the update.
+        number (int): Number of images moved.
+
+    Returns:
+        dict: Update document.
+    """
+    return {'$inc': {f'counts.{old_status}': -number,
+                     f'counts.{new_status}': number,
+                     }}
+
+
+def group_stats_built():
+    """
+    Check if the group_stats collection holds the counts of all groups.
+
+    The collection is complete once it was built by rebuild_group_stats,
+    or by the service creating the database, which write the marker
+    document. The result is cached by the worker from then on.
+
+    Returns:
+        bool: True if the counts can be read from group_stats.
+    """
+    if not _built.is_set() and group_stats_collection.count_documents(
+            {'_id': BUILT_MARKER_ID},
+            limit=1,
+            ):
+        _built.set()
+    return _built.is_set()
+
+
+def rebuild_group_stats(group_ids=None):
+    """
+    Recount images of groups and rewrite their 'group_stats' documents.
+
+    Images are counted by the aggregation pipeline on the server, using
+    the images (group_id, status, ...) index.
+
+    Args:
+        group_ids (list | None): Groups to rebuild. If None the whole
+            collection is replaced and marked as built.
+    """
+    pipeline = []
+    if group_ids is not None:
+        pipeline.append({'$match': {'group_id': {'$in': list(group_ids)}}})
+
+    pipeline.extend([
+        {
+            '$group': {
+                '_id': {'group_id': '$group_id', 'status': '$status'},
+                'count': {'$sum': 1},
+            }
+        },
+        {
+            '$group': {
+                '_id': '$_id.group_id',
+                'total': {'$sum': '$count'},
+                'counts': {'$push': {'k': '$_id.status', 'v': '$count'}},
+            }
+        },
+        {
+            '$project': {
+                'total': 1,
+                'counts': {'$arrayToObject': '$counts'},
+            }
+        },
+    ])
+
+    if group_ids is None:
+        # replace the whole collection at once
+        pipeline.append({'$out': MONGODB_GROUP_STATS_COLLECTION_NAME})
+    else:
+        pipeline.append({
+            '$merge': {
+                'into': MONGODB_GROUP_STATS_COLLECTION_NAME,
+                'whenMatched': 'replace',
+                'whenNotMatched': 'insert',
+            }
+        })
+
+    images_collection.aggregate(pipeline)
+    if group_ids is None:
+        group_stats_collection.update_one(
+            {'_id': BUILT_MARKER_ID},
+            {'$set': {'built_at': datetime.utcnow()}},
+            upsert=True,
+            )
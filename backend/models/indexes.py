@@ -0,0 +1,107 @@
+"""
+MongoDB Index Registry
+
+All indexes of the service are declared here and built by
+'flask --app run.py ensure-indexes', which compares them with the indexes
+of the database and creates the missing ones. Nothing is created when the
+application is imported or connects, so workers and CLI commands start
+without index round trips. 'ensure-indexes --check' only warns about
+missing indexes, it is meant for deploy pipelines.
+
+Usage:
+    missing = missing_indexes(db)
+    created = ensure_indexes(db)
+"""
+
+from collections.abc import Mapping
+from pymongo import IndexModel
+from config.config import (MONGODB_IMAGE_COLLECTION_NAME,
+                           MONGODB_GROUPS_COLLECTION_NAME,
+                           MONGODB_DAILY_COUNTS_COLLECTION_NAME,
+                           )
+from models.pipelines import STATISTICS_INDEX, GROUP_STATISTICS_INDEX
+
+# declared indexes by collection name
+INDEXES = {
+    MONGODB_IMAGE_COLLECTION_NAME: [
+        IndexModel([("status", 1), ("created_at", -1)]),
+        # covers /statistics aggregations over a range of creation dates
+        IndexModel(STATISTICS_INDEX),
+        # and of one group
+        IndexModel(GROUP_STATISTICS_INDEX),
+        # images of groups, newest first, for /groups and group updates
+        IndexModel([("group_id", 1), ("status", 1), ("last_updated_at", -1)]),
+    ],
+    MONGODB_GROUPS_COLLECTION_NAME: [
+        # pages of groups by name, for page numbers and cursors
+        IndexModel([("name", 1), ("_id", 1)]),
+    ],
+    MONGODB_DAILY_COUNTS_COLLECTION_NAME: [
+        IndexModel([("day", 1), ("status", 1)], unique=True),
+    ],
+}
+
+
+def _keys(key):
+    """Return index keys as a list of (field, direction) pairs."""
+    pairs = key.items() if isinstance(key, Mapping) else key
+    # the server may report directions as floats
+    return [(field, int(direction) if isinstance(direction, float)
+             else direction)
+            for field, direction in pairs]
+
+
+def is_declared_in(index, information):
+    """
+    Check if an index exists, with the same keys and uniqueness.
+
+    Args:
+        index (IndexModel): Declared index.
+        information (dict): 'index_information()' of the collection.
+
+    Returns:
+        bool: True if the collection has the index.
+    """
+    keys = _keys(index.document['key'])
+    unique = index.document.get('unique', False)
+    return any(_keys(existing['key']) == keys
+               and existing.get('unique', False) == unique
+               for existing in information.values())
+
+
+def missing_indexes(database):
+    """
+    Compare declared indexes with the indexes of the database.
+
+    Args:
+        database (Database): Application database.
+
+    Returns:
+        list: (collection_name, IndexModel) pairs of missing indexes.
+    """
+    missing = []
+    for collection_name, indexes in INDEXES.items():
+        information = database[collection_name].index_information()
+        missing.extend((collection_name, index) for index in indexes
+                       if not is_declared_in(index, information))
+    return missing
+
+
+def ensure_indexes(database):
+    """
+    Build the declared indexes missing in the database.
+
+    Args:
+        database (Database): Application database.
+
+    Returns:
+        list: (collection_name, index name) pairs of created indexes.
+    """
+    created = []
+    by_collection = {}
+    for collection_name, index in missing_indexes(database):
+        by_collection.setdefault(collection_name, []).append(index)
+    for collection_name, indexes in by_collection.items():
+        names = database[collection_name].create_indexes(indexes)
+        created.extend((collection_name, name) for name in names)
+    return created
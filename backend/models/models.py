@@ -1,14 +1,20 @@
 """
-MongoDB Database Setup and Index Creation
+MongoDB Database Setup
 
 This script is responsible for setting up the MongoDB database
-connection and creating indexes
-to optimize database queries for your application. It uses the PyMongo library
-to interact with MongoDB.
+connection. It uses the PyMongo library to interact with MongoDB.
+Indexes are declared in 'models.indexes' and built by the
+'ensure-indexes' command, importing this module does no database I/O.
+
+The MongoClient is created lazily on first use in every process, so no
+client (and no client thread) is inherited by gunicorn workers forked
+from the master. Pool sizes of a worker are set by 'configure_client'
+from the gunicorn 'post_fork' hook, see gunicorn_config.py.
 
 Usage:
 - Configure the MongoDB connection details and database/collection names in
 'config.config'.
+- Import 'db' and the collections and use them as pymongo objects.
 
 
 Dependencies:
@@ -18,23 +24,111 @@ and collection names,
   should be defined in 'config.config'.
 """
 
+import os
+import threading
 from pymongo import MongoClient
 from config.config import (MONGODB_URI,
                            MONGODB_DB_NAME,
                            MONGODB_IMAGE_COLLECTION_NAME,
                            MONGODB_GROUPS_COLLECTION_NAME,
+                           MONGODB_GROUP_STATS_COLLECTION_NAME,
+                           MONGODB_DAILY_COUNTS_COLLECTION_NAME,
                            )
 
-# Establish a connection to the MongoDB server
-client = MongoClient(MONGODB_URI)
+_client = None
+_client_pid = None
+_client_options = {}
+_client_lock = threading.Lock()
+
+
+def configure_client(**options):
+    """
+    Set MongoClient options of this process, such as pool sizes.
+
+    Has to be called before the first database access of the process.
+
+    Args:
+        **options: Keyword arguments of MongoClient.
+    """
+    _client_options.update(options)
+
+
+def get_client_options():
+    """Return MongoClient options set by 'configure_client'."""
+    return dict(_client_options)
+
+
+def get_client():
+    """
+    Return the MongoClient of this process, create it on first use.
+
+    A client inherited from the parent process is never used, a forked
+    process gets its own one.
+
+    Returns:
+        MongoClient: Client of this process.
+    """
+    global _client, _client_pid
+    if _client is not None and _client_pid == os.getpid():
+        return _client
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = MongoClient(MONGODB_URI, **_client_options)
+            _client_pid = os.getpid()
+    return _client
+
+
+def run_in_transaction(callback):
+    """
+    Run callback in a transaction, so its writes are applied all or none.
+
+    The callback is run again if the transaction fails with a transient
+    error, e.g. a write conflict with a concurrent transaction.
+    Transactions need a replica set or a sharded cluster (e.g. Atlas).
+
+    Args:
+        callback (callable): Function taking the ClientSession to pass
+            to every read and write of the transaction.
+
+    Returns:
+        The return value of the callback.
+    """
+    with get_client().start_session() as session:
+        return session.with_transaction(callback)
+
+
+class _LazyDatabase:
+    """The application database of the client of this process."""
+
+    def __getattr__(self, name):
+        return getattr(get_client()[MONGODB_DB_NAME], name)
+
+    def __getitem__(self, name):
+        return get_client()[MONGODB_DB_NAME][name]
+
+
+class _LazyCollection:
+    """A collection of the application database of this process."""
+
+    def __init__(self, name):
+        self._collection_name = name
+
+    def __getattr__(self, name):
+        return getattr(get_client()[MONGODB_DB_NAME][self._collection_name],
+                       name,
+                       )
+
 
 # Access the specified MongoDB database
-db = client[MONGODB_DB_NAME]
+db = _LazyDatabase()
 
 # Access the collections in the database
-images_collection = db[MONGODB_IMAGE_COLLECTION_NAME]
-groups_collection = db[MONGODB_GROUPS_COLLECTION_NAME]
+images_collection = _LazyCollection(MONGODB_IMAGE_COLLECTION_NAME)
+groups_collection = _LazyCollection(MONGODB_GROUPS_COLLECTION_NAME)
+# per group image counts maintained by status updates, see group_stats.py
+group_stats_collection = _LazyCollection(MONGODB_GROUP_STATS_COLLECTION_NAME)
+# image counts per creation day and status, see daily_counts.py
+daily_counts_collection = _LazyCollection(
+    MONGODB_DAILY_COUNTS_COLLECTION_NAME
+    )
 
-# Create indexes for optimized database queries
-images_collection.create_index([("status", 1), ("created_at", -1)])
-groups_collection.create_index([("name", 1)])
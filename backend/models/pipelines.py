@@ -0,0 +1,299 @@
+"""
+MongoDB Aggregation Pipelines
+
+This module builds the aggregation pipelines used by the endpoints,
+so the same query shapes can be reused by views, benchmarks and checks.
+
+Usage:
+- Build a pipeline with one of the functions below and pass it
+to 'aggregate' of the corresponding collection from 'models.models'.
+"""
+
+from config.config import (MONGODB_IMAGE_COLLECTION_NAME,
+                           MONGODB_GROUP_STATS_COLLECTION_NAME,
+                           VALID_STATUSES,
+                           DEFAULT_IMAGE_FIELDS,
+                           )
+
+# index covering statistics_pipeline, the images are counted from index
+# keys alone (no FETCH stage), pass it as 'hint' of the aggregation
+STATISTICS_INDEX = [("created_at", 1), ("status", 1)]
+# the same for statistics of one group
+GROUP_STATISTICS_INDEX = [("group_id", 1), ("created_at", 1), ("status", 1)]
+
+
+def statistics_hint(group_id=None):
+    """
+    Build the 'hint' option of a statistics_pipeline aggregation.
+
+    Unlike 'find', 'aggregate' of pymongo sends the hint to the server as
+    it is given, so the index keys are passed as a document, not as a list
+    of (key, direction) pairs.
+
+    Args:
+        group_id (ObjectId | None): Group the images are counted of.
+
+    Returns:
+        dict: Keys of STATISTICS_INDEX or GROUP_STATISTICS_INDEX.
+    """
+    return dict(STATISTICS_INDEX if group_id is None
+                else GROUP_STATISTICS_INDEX)
+
+
+def groups_pipeline(status_filter=None, after=None, skip=None, limit=None,
+                    images_per_group=None, fields=None,
+                    count_from_group_stats=True):
+    """
+    Build the pipeline for the groups collection returning groups with images.
+
+    The page of groups is selected first, in (name, _id) order served by
+    the groups index, and only the selected groups are joined with images.
+    The cost of a page therefore depends on the page size, not on the total
+    number of groups and images in the database.
+    Images are joined with a correlated '$lookup' sub-pipeline
+    (MongoDB 5.0+), the status filter and the 'last_updated_at' ordering
+    are resolved by the images (group_id, status, last_updated_at) index.
+
+    Args:
+        status_filter (str | None): Return only images with this status.
+        after (tuple | None): ('name', '_id') of the last group of the
+            previous page, for cursor pagination.
+        skip (int | None): Number of groups to skip, for page pagination.
+        limit (int | None): Maximum number of groups to return.
+        images_per_group (int | None): Return only this number of the most
+            recently updated images of each group.
+        fields (list | None): Image fields to return, '_id' is always
+            returned. Defaults to config DEFAULT_IMAGE_FIELDS.
+        count_from_group_stats (bool): Read the number of matching images
+            from the 'group_stats' collection if images_per_group is set,
+            False to count them over images until the collection is built.
+
+    Returns:
+        list: Aggregation pipeline. Every selected group is returned with
+        'images' sorted by 'last_updated_at' desc and their 'count',
+        groups without matching images have an empty list and count 0.
+        If images_per_group is set 'count' is still the total number of
+        matching images, of the valid statuses as the list, and 'has_more'
+        tells if some of them were cut off.
+    """
+    pipeline = []
+
+    if after is not None:
+        last_name, last_id = after
+        # seek right after the last group of the previous page
+        pipeline.append({
+            '$match': {
+                '$or': [
+                    {'name': {'$gt': last_name}},
+                    {'name': last_name, '_id': {'$gt': last_id}},
+                ]
+            }
+        })
+
+    pipeline.append({'$sort': {'name': 1, '_id': 1}})
+    if skip:
+        pipeline.append({'$skip': skip})
+    if limit is not None:
+        pipeline.append({'$limit': limit})
+
+    # the status condition is always on the index so the images of a group
+    # come back already sorted from the (group_id, status, last_updated_at)
+    # index: one index range for a status or a merge of the ranges of all
+    # valid statuses, no in-memory sort is needed
+    status_condition = status_filter or {'$in': VALID_STATUSES}
+
+    images_pipeline = [
+        {'$match': {'status': status_condition}},
+        {'$sort': {'last_updated_at': -1}},
+    ]
+    if images_per_group is not None:
+        images_pipeline.append({'$limit': images_per_group})
+    # drop not requested fields on the server so they are never
+    # sent over the wire and serialized
+    images_pipeline.append({
+        '$project': {field: 1 for field in fields or DEFAULT_IMAGE_FIELDS}
+    })
+
+    # join images only for the selected groups
+    pipeline.append({
+        '$lookup': {
+            'from': MONGODB_IMAGE_COLLECTION_NAME,
+            'localField': '_id',
+            'foreignField': 'group_id',
+            'pipeline': images_pipeline,
+            'as': 'images'
+        }
+    })
+
+    if images_per_group is None:
+        pipeline.append({'$addFields': {'count': {'$size': '$images'}}})
+        return pipeline
+
+    if count_from_group_stats:
+        # read the number of matching images of the group from its
+        # group_stats document instead of counting them, summed over
+        # the same statuses as the list ('total' counts all of them)
+        statuses = [status_filter] if status_filter else VALID_STATUSES
+        pipeline.extend([
+            {
+                '$lookup': {
+                    'from': MONGODB_GROUP_STATS_COLLECTION_NAME,
+                    'localField': '_id',
+                    'foreignField': '_id',
+                    'as': 'group_stats'
+                }
+            },
+            {
+                '$addFields': {
+                    'count': {
+                        '$let': {
+                            'vars': {'stats': {'$first': '$group_stats'}},
+                            'in': {'$add': [
+                                {'$ifNull': [f'$$stats.counts.{status}', 0]}
+                                for status in statuses
+                            ]},
+                        }
+                    }
+                }
+            },
+        ])
+    else:
+        # count the matching images on the (group_id, status, ...) index
+        pipeline.extend([
+            {
+                '$lookup': {
+                    'from': MONGODB_IMAGE_COLLECTION_NAME,
+                    'localField': '_id',
+                    'foreignField': 'group_id',
+                    'pipeline': [
+                        {'$match': {'status': status_condition}},
+                        {'$count': 'count'},
+                    ],
+                    'as': 'group_stats'
+                }
+            },
+            {
+                '$addFields': {
+                    'count': {'$ifNull': [{'$first': '$group_stats.count'}, 0]}
+                }
+            },
+        ])
+    pipeline.extend([
+        {
+            '$addFields': {
+                'has_more': {'$gt': ['$count', {'$size': '$images'}]}
+            }
+        },
+        {
+            '$project': {'group_stats': 0}
+        },
+    ])
+
+    return pipeline
+
+
+def statistics_pipeline(start_date, end_date, bucket=None, group_id=None):
+    """
+    Build the pipeline for the images collection counting images by status.
+
+    The pipeline reads only 'created_at' and 'status' (and 'group_id'),
+    so it is covered by STATISTICS_INDEX (GROUP_STATISTICS_INDEX) of the
+    images collection.
+
+    Args:
+        start_date (datetime): Count images created since this date.
+        end_date (datetime): Count images created before this date.
+        bucket (str | None): One of STATISTICS_BUCKETS to count images
+            per hour, day or week of their creation.
+        group_id (ObjectId | None): Count only images of this group.
+
+    Returns:
+        list: Aggregation pipeline returning {"_id": status, "count": n}
+        documents, or {"start": datetime, "counts": {status: n}} documents
+        sorted by start if bucket is given.
+    """
+    match = {
+        '$match': {
+            'created_at': {'$gte': start_date, '$lt': end_date}
+        }
+    }
+    if group_id is not None:
+        match['$match'] = {'group_id': group_id, **match['$match']}
+    if bucket:
+        return [match] + _histogram_stages('$created_at', 1, bucket)
+    return [
+        match,
+        {
+            '$group': {
+                '_id': '$status',
+                'count': {'$sum': 1}
+            }
+        }
+    ]
+
+
+def daily_counts_pipeline(start_day, end_day, bucket=None):
+    """
+    Build the pipeline for the daily_status_counts collection summing
+    counts of days by status.
+
+    Args:
+        start_day (datetime): First day (midnight UTC) of the period.
+        end_day (datetime): Day (midnight UTC) after the period.
+        bucket (str | None): 'day' or 'week' to sum counts per day or
+            week, hours are not kept in the collection.
+
+    Returns:
+        list: Aggregation pipeline returning {"_id": status, "count": n}
+        documents, or {"start": datetime, "counts": {status: n}} documents
+        sorted by start if bucket is given.
+    """
+    # statuses no image of the period has are left out as with images
+    match = {
+        '$match': {
+            'day': {'$gte': start_day, '$lt': end_day},
+            'count': {'$gt': 0},
+        }
+    }
+    if bucket:
+        return [match] + _histogram_stages('$day', '$count', bucket)
+    return [
+        match,
+        {
+            '$group': {
+                '_id': '$status',
+                'count': {'$sum': '$count'}
+            }
+        }
+    ]
+
+
+def _histogram_stages(date, count, bucket):
+    """Group counts by bucket start and status into one document a bucket."""
+    trunc = {'date': date, 'unit': bucket}
+    if bucket == 'week':
+        trunc['startOfWeek'] = 'monday'
+    return [
+        {
+            '$group': {
+                '_id': {'start': {'$dateTrunc': trunc}, 'status': '$status'},
+                'count': {'$sum': count}
+            }
+        },
+        {
+            '$group': {
+                '_id': '$_id.start',
+                'counts': {'$push': {'k': '$_id.status', 'v': '$count'}}
+            }
+        },
+        {
+            '$sort': {'_id': 1}
+        },
+        {
+            '$project': {
+                '_id': 0,
+                'start': '$_id',
+                'counts': {'$arrayToObject': '$counts'}
+            }
+        }
+    ]
@@ -0,0 +1,153 @@
+"""
+Query Plan Checks
+
+Runs 'explain' on the query shapes of the endpoints and reports shapes
+which scan a whole collection (COLLSCAN) or, if they are meant to be
+covered by an index, read documents (FETCH). Used by
+'flask --app run.py check-query-plans' after index or pipeline changes.
+
+Usage:
+    problems = check_query_plans()
+"""
+
+from datetime import datetime, timedelta
+from bson import ObjectId
+from models.models import (db,
+                           images_collection,
+                           groups_collection,
+                           daily_counts_collection,
+                           )
+from models.pipelines import groups_pipeline, daily_counts_pipeline
+from utils.params import statistics_query
+from config.config import DEFAULT_PAGINATION_NUMBER_OF_GROUPS_TO_RETURN
+
+
+def query_shapes():
+    """
+    Build the queries the endpoints run, with sample values.
+
+    Returns:
+        list: (name, collection, command, covered) tuples, command is the
+        body of an 'aggregate' or 'find' command and covered tells if the
+        query has to be answered from index keys alone.
+    """
+    limit = DEFAULT_PAGINATION_NUMBER_OF_GROUPS_TO_RETURN
+    # not midnight, so the statistics are counted over images
+    end = datetime.utcnow().replace(minute=30)
+    start = end - timedelta(days=1)
+    sample_id = ObjectId('0' * 24)
+
+    def aggregate(collection, pipeline, **options):
+        return {'aggregate': collection.name,
+                'pipeline': pipeline,
+                'cursor': {},
+                **options,
+                }
+
+    def statistics(bucket=None, group_id=None):
+        # the query of the endpoint with the options passed to 'aggregate'
+        _, pipeline, options = statistics_query(start, end, bucket, group_id)
+        return aggregate(images_collection, pipeline, **options)
+
+    def find(collection, query):
+        return {'find': collection.name, 'filter': query}
+
+    return [
+        ("GET /groups?page", groups_collection,
+         aggregate(groups_collection, groups_pipeline(skip=limit,
+                                                      limit=limit,
+                                                      )),
+         False),
+        ("GET /groups?cursor", groups_collection,
+         aggregate(groups_collection, groups_pipeline(after=('', sample_id),
+                                                      limit=limit,
+                                                      )),
+         False),
+        ("GET /groups?status&images_per_group", groups_collection,
+         aggregate(groups_collection, groups_pipeline(status_filter='new',
+                                                      limit=limit,
+                                                      images_per_group=1,
+                                                      )),
+         False),
+        ("GET /groups?images_per_group (group_stats not built)",
+         groups_collection,
+         aggregate(groups_collection, groups_pipeline(
+             limit=limit,
+             images_per_group=1,
+             count_from_group_stats=False,
+             )),
+         False),
+        ("GET /statistics (images)", images_collection,
+         statistics(),
+         True),
+        ("GET /statistics?bucket (images)", images_collection,
+         statistics('day'),
+         True),
+        ("GET /groups/<group_id>/statistics", images_collection,
+         statistics(group_id=sample_id),
+         True),
+        ("GET /statistics (rollup)", daily_counts_collection,
+         aggregate(daily_counts_collection,
+                   daily_counts_pipeline(start, end, 'day')),
+         False),
+        ("PUT /images/<image_id>", images_collection,
+         find(images_collection, {'_id': sample_id,
+                                  'status': {'$ne': 'new'}}),
+         False),
+        ("PUT /groups/<group_id>/images/status", images_collection,
+         find(images_collection, {'group_id': sample_id,
+                                  'status': {'$ne': 'new'}}),
+         False),
+    ]
+
+
+def plan_stages(explain):
+    """
+    Collect names of all plan stages of an explain output.
+
+    Handles the classic and the slot based engine formats and the
+    aggregation stages of the pipeline, including the collection scans
+    reported for '$lookup' stages.
+
+    Args:
+        explain (dict): Output of the 'explain' command.
+
+    Returns:
+        set: Stage names such as 'IXSCAN', 'FETCH' or 'COLLSCAN'.
+    """
+    stages = set()
+    nodes = [explain]
+    while nodes:
+        node = nodes.pop()
+        if isinstance(node, list):
+            nodes.extend(node)
+        elif isinstance(node, dict):
+            if isinstance(node.get('stage'), str):
+                stages.add(node['stage'])
+            if node.get('collectionScans'):
+                stages.add('COLLSCAN')
+            # rejected plans are not run
+            nodes.extend(value for key, value in node.items()
+                         if key != 'rejectedPlans')
+    return stages
+
+
+def check_query_plans():
+    """
+    Explain every query shape and find the regressed ones.
+
+    Returns:
+        list: (name, stages, problem) tuples for every query shape, problem
+        is None for a good plan.
+    """
+    results = []
+    for name, collection, command, covered in query_shapes():
+        explain = db.command('explain', command, verbosity='executionStats')
+        stages = plan_stages(explain)
+        problem = None
+        if 'COLLSCAN' in stages:
+            problem = f"collection scan of {collection.name}"
+        elif covered and 'FETCH' in stages:
+            problem = "not covered by an index, documents are fetched"
+        results.append((name, sorted(stages), problem))
+    return results
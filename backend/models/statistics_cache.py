@@ -0,0 +1,187 @@
+"""
+Per Worker Cache of /statistics
+
+Every worker keeps the results of /statistics for STATISTICS_CACHE_TTL
+seconds, so polling dashboards cost one aggregation per TTL and query
+per worker. Status changes made by PUT /images/<image_id> of the same
+worker are applied to the cached counts (-1 for the old status, +1 for
+the new one) instead of dropping them. Bulk and group updates clear the
+cache of the worker. Changes made by other workers and by the write-behind
+queue are visible after the TTL at the latest.
+
+A result counted while a status update was being written may or may not
+include it. Reads and writes take a generation of the cache before they
+go to the database: a result is not cached if a write began or the cache
+was cleared during its read, and a status update is applied only to the
+results read before the update began, the other results counting the
+image are dropped.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from config.config import STATISTICS_CACHE_TTL, STATISTICS_CACHE_MAX_ENTRIES
+
+
+def truncate(date, bucket):
+    """Return the start of the hour, day or week (from monday) of the date."""
+    if bucket == 'hour':
+        return datetime(date.year, date.month, date.day, date.hour)
+    day = datetime(date.year, date.month, date.day)
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    return day
+
+
+def _move(counts, old_status, new_status):
+    """Return a copy of {status: count} with one image moved."""
+    counts = dict(counts)
+    counts[old_status] = counts.get(old_status, 0) - 1
+    counts[new_status] = counts.get(new_status, 0) + 1
+    # statuses without images are left out as by the aggregation
+    return {status: count for status, count in counts.items() if count > 0}
+
+
+class StatisticsCache:
+    """
+    Cache of /statistics results of one worker.
+
+    Cached values are never changed in place, so a response being
+    serialized is not affected by a concurrent status update.
+
+    Args:
+        ttl (float): Seconds a result is kept, 0 disables the cache.
+        max_entries (int): Number of results kept, the oldest are dropped.
+    """
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    def get(self, key):
+        """
+        Return a cached result.
+
+        Args:
+            key (tuple): Query parameters of the request.
+
+        Returns:
+            tuple | None: (start_date, end_date, value) or None if the
+            result is not cached or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry['expires'] <= time.monotonic():
+                del self._entries[key]
+                return None
+            return entry['start'], entry['end'], entry['value']
+
+    def begin_read(self):
+        """
+        Return the generation to pass to put, taken before the result
+        is read from the database.
+        """
+        with self._lock:
+            return self._generation
+
+    def begin_write(self):
+        """
+        Return the generation to pass to move_image, taken before the
+        status update is written to the database.
+        """
+        with self._lock:
+            self._generation += 1
+            return self._generation
+
+    def put(self, key, start_date, end_date, bucket, value, group_id=None,
+            generation=None):
+        """
+        Cache a result.
+
+        Args:
+            key (tuple): Query parameters of the request.
+            start_date (datetime): Start of the counted period.
+            end_date (datetime): End (excluded) of the counted period.
+            bucket (str | None): Bucket of the histogram or None.
+            value (dict | list): {status: count} totals or the series
+                of {"start": datetime, "counts": {status: count}} items.
+            group_id (ObjectId | None): Group the images were counted of,
+                None for all images.
+            generation (int | None): Returned by begin_read before the
+                result was read, None for the current generation.
+        """
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            if generation is None:
+                generation = self._generation
+            elif generation != self._generation:
+                # a status update may be counted or not
+                return
+            self._entries.pop(key, None)
+            self._entries[key] = {
+                'expires': time.monotonic() + self.ttl,
+                'start': start_date,
+                'end': end_date,
+                'bucket': bucket,
+                'group_id': group_id,
+                'generation': generation,
+                'value': value,
+            }
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def move_image(self, created_at, group_id, old_status, new_status,
+                   generation):
+        """
+        Move an image from one status to another in all cached results
+        counting it.
+
+        Args:
+            created_at (datetime): Creation date of the image.
+            group_id (ObjectId): Group of the image.
+            old_status (str): Status before the update.
+            new_status (str): Status after the update.
+            generation (int): Returned by begin_write before the update
+                was written.
+        """
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if not entry['start'] <= created_at < entry['end']:
+                    continue
+                if entry['group_id'] not in (None, group_id):
+                    continue
+                if entry['generation'] >= generation:
+                    # read while the update was being written
+                    del self._entries[key]
+                    continue
+                if entry['bucket'] is None:
+                    entry['value'] = _move(entry['value'],
+                                           old_status,
+                                           new_status,
+                                           )
+                    continue
+                start = truncate(created_at, entry['bucket'])
+                entry['value'] = [
+                    {'start': item['start'],
+                     'counts': _move(item['counts'], old_status, new_status),
+                     } if item['start'] == start else item
+                    for item in entry['value']
+                    ]
+
+    def clear(self):
+        """Drop all cached results and the results being read."""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+
+statistics_cache = StatisticsCache(STATISTICS_CACHE_TTL,
+                                   STATISTICS_CACHE_MAX_ENTRIES,
+                                   )
@@ -0,0 +1,251 @@
+"""
+Image Status Updates
+
+Applies many image status updates with a constant number of round trips
+to MongoDB: one read of the current statuses, one unordered 'bulk_write'
+of the images and one 'bulk_write' of the per group and per day counts
+each, all in one transaction.
+
+The compare-and-set of a single image (PUT /images/<image_id>) is built
+and its results are turned into responses here too, so the Flask and the
+ASGI endpoints only run the queries with their driver.
+
+Usage:
+    results = bulk_update_statuses([(image_id, 'accepted'), ...])
+
+    image_filter, update = status_update_query(image_id, 'accepted')
+    image = images_collection.find_one_and_update(
+        image_filter, update,
+        projection=STATUS_UPDATE_PROJECTION,
+        return_document=ReturnDocument.BEFORE,
+        )
+    body, status_code, etag = updated_result(image)
+"""
+
+import logging
+from collections import Counter
+from datetime import datetime
+from pymongo import UpdateOne
+from models.models import (run_in_transaction,
+                           images_collection,
+                           group_stats_collection,
+                           )
+from models.daily_counts import move_images_in_daily_counts
+from models.statistics_cache import statistics_cache
+from utils.params import version_condition
+
+logger = logging.getLogger(__name__)
+
+UPDATED = 'updated'
+UNCHANGED = 'unchanged'
+NOT_FOUND = 'not_found'
+
+# fields of the image returned by the compare-and-set of one image,
+# everything the counts and the ETag of the response are updated from
+STATUS_UPDATE_PROJECTION = {'status': 1,
+                            'group_id': 1,
+                            'created_at': 1,
+                            'version': 1,
+                            }
+# fields read to explain why the compare-and-set did not update the image
+CURRENT_VERSION_PROJECTION = {'status': 1, 'version': 1}
+
+
+def status_update_query(image_id, new_status, if_match=None):
+    """
+    Build the compare-and-set of one image status update.
+
+    The image is updated only if the status changes and, with an If-Match
+    header, if the image still has one of its versions. Run it with
+    'find_one_and_update', STATUS_UPDATE_PROJECTION and
+    ReturnDocument.BEFORE to get the image before the update in the same
+    round trip.
+
+    Args:
+        image_id (ObjectId): Image to update.
+        new_status (str): New valid status.
+        if_match (werkzeug.datastructures.ETags | None): Parsed If-Match
+            header of the request.
+
+    Returns:
+        tuple: (filter, update) documents.
+    """
+    image_filter = {
+        '_id': image_id,
+        'status': {'$ne': new_status},
+    }
+    if if_match and not if_match.star_tag:
+        image_filter['version'] = version_condition(if_match)
+    update = {
+        '$set': {
+            'status': new_status,
+            'last_updated_at': datetime.utcnow()
+            },
+        '$inc': {'version': 1},
+    }
+    return image_filter, update
+
+
+def updated_result(image):
+    """
+    Build the response of an image updated by the compare-and-set.
+
+    Args:
+        image (dict): The image before the update.
+
+    Returns:
+        tuple: (body, status_code, etag) of the response.
+    """
+    return ({'message': 'Image status updated'},
+            200,
+            str(image.get('version', 0) + 1),
+            )
+
+
+def move_image_in_statistics_cache(image, new_status, generation):
+    """
+    Apply a committed status update to the cached /statistics results.
+
+    The update is written already, so a failure of the cache does not fail
+    the request. It is logged and the cache of the worker is cleared
+    instead, the results are counted again by the next requests.
+
+    Args:
+        image (dict): The image before the update.
+        new_status (str): Status of the image after the update.
+        generation (int): Returned by statistics_cache.begin_write before
+            the update was written.
+    """
+    try:
+        statistics_cache.move_image(image['created_at'],
+                                    image['group_id'],
+                                    image['status'],
+                                    new_status,
+                                    generation,
+                                    )
+    except Exception:
+        logger.exception("Statistics cache update of image %s failed",
+                         image['_id'])
+        statistics_cache.clear()
+
+
+def not_updated_result(image, if_match=None):
+    """
+    Build the response of an image the compare-and-set did not update.
+
+    The image either has the requested status already, was changed since
+    the client read it or does not exist.
+
+    Args:
+        image (dict | None): The image read with CURRENT_VERSION_PROJECTION
+            after the compare-and-set, None if it does not exist.
+        if_match (werkzeug.datastructures.ETags | None): Parsed If-Match
+            header of the request.
+
+    Returns:
+        tuple: (body, status_code, etag) of the response, etag is None
+        for errors.
+    """
+    if not image:
+        return {
+            "code": 400,
+            "name": "Image not found",
+            "description": "Specified ID was not found in database",
+            }, 400, None
+    version = image.get('version', 0)
+    if if_match and not if_match.contains(str(version)):
+        return {
+            "code": 412,
+            "name": "Precondition Failed",
+            "description": ("Image was changed by another request, "
+                            f"current version is {version}"),
+            }, 412, None
+    return ({'message': 'Requested status is the same as current'},
+            200,
+            str(version),
+            )
+
+
+def bulk_update_statuses(updates):
+    """
+    Set statuses of many images at once.
+
+    The statuses are read, the images written and their counts moved in
+    one transaction, so concurrent updates are never overwritten silently
+    and the counts always match the images. A transaction conflicting with
+    a concurrent write is run again from the read.
+
+    Args:
+        updates (list): (image_id, new_status) pairs with ObjectId ids and
+            valid statuses. If an image is listed several times the last
+            status wins.
+
+    Returns:
+        dict: Result for every image id, one of UPDATED, UNCHANGED and
+        NOT_FOUND.
+    """
+    new_statuses = dict(updates)
+    now = datetime.utcnow()
+
+    def write(session):
+        images = {
+            image['_id']: image
+            for image in images_collection.find(
+                {'_id': {'$in': list(new_statuses)}},
+                {'status': 1, 'group_id': 1, 'created_at': 1},
+                session=session,
+                )
+            }
+
+        results = {}
+        operations = []
+        moves = []
+        for image_id, new_status in new_statuses.items():
+            image = images.get(image_id)
+            if image is None:
+                results[image_id] = NOT_FOUND
+            elif image['status'] == new_status:
+                results[image_id] = UNCHANGED
+            else:
+                results[image_id] = UPDATED
+                operations.append(UpdateOne(
+                    {'_id': image_id, 'status': image['status']},
+                    {
+                        '$set': {'status': new_status,
+                                 'last_updated_at': now,
+                                 },
+                        '$inc': {'version': 1},
+                    },
+                    ))
+                moves.append((image, new_status))
+
+        if operations:
+            images_collection.bulk_write(operations,
+                                         ordered=False,
+                                         session=session,
+                                         )
+            _move_images_in_group_stats(moves, session)
+            move_images_in_daily_counts(
+                ((image['created_at'], image['status'], new_status, 1)
+                 for image, new_status in moves),
+                session=session,
+                )
+        return results
+
+    return run_in_transaction(write)
+
+
+def _move_images_in_group_stats(moves, session=None):
+    """Apply (image, new_status) moves to group counts in one bulk write."""
+    increments = {}
+    for image, new_status in moves:
+        counts = increments.setdefault(image['group_id'], Counter())
+        counts[f"counts.{image['status']}"] -= 1
+        counts[f"counts.{new_status}"] += 1
+
+    group_stats_collection.bulk_write(
+        [UpdateOne({'_id': group_id}, {'$inc': dict(counts)})
+         for group_id, counts in increments.items()],
+        ordered=False,
+        session=session,
+        )
@@ -0,0 +1,99 @@
+"""
+Connection Warm-Up
+
+Opens the connections of the worker's pool and runs one cheap query per
+collection before the worker accepts requests. The first requests after
+a deploy then do not pay for DNS SRV resolution, TLS handshakes and
+server selection. It is called from the gunicorn 'post_fork' hook (see
+gunicorn_config.py) and, in processes without it, by the first
+/healthz/ready request.
+
+The warm-up gives up after MONGODB_WARM_UP_TIMEOUT seconds instead of
+waiting for the server selection timeout of the client (30 seconds), so
+a worker booting while MongoDB is unreachable is not killed by gunicorn
+for a missed heartbeat over and over.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pymongo
+from config.config import MONGODB_WARM_UP_TIMEOUT
+from models.models import (get_client,
+                           get_client_options,
+                           images_collection,
+                           groups_collection,
+                           group_stats_collection,
+                           daily_counts_collection,
+                           )
+
+# report of the warm-up of this process, None before it succeeded
+_report = None
+
+
+def warm_up(timeout=MONGODB_WARM_UP_TIMEOUT):
+    """
+    Open minPoolSize connections, ping the server and read one document
+    of every collection.
+
+    The connections are opened by concurrent pings, so every ping has
+    to check out a connection of its own.
+
+    Args:
+        timeout (float): Seconds the whole warm-up may take.
+
+    Returns:
+        dict: Number of opened connections and milliseconds taken by
+        the pings, the queries and the whole warm-up.
+
+    Raises:
+        PyMongoError: If MongoDB does not answer in time, for example
+            pymongo.errors.ServerSelectionTimeoutError.
+        threading.BrokenBarrierError: If the pings can not start
+            together in time.
+    """
+    global _report
+    start = time.perf_counter()
+    deadline = time.monotonic() + timeout
+    client = get_client()
+    connections = max(get_client_options().get('minPoolSize', 1), 1)
+
+    # wait until all threads are ready, so pings run at the same time
+    barrier = threading.Barrier(connections, timeout=timeout)
+
+    def time_left():
+        # pymongo.timeout(0) would mean no timeout at all
+        return max(deadline - time.monotonic(), 0.001)
+
+    def ping():
+        barrier.wait()
+        # the timeout is per thread, it limits server selection as well
+        with pymongo.timeout(time_left()):
+            client.admin.command('ping')
+
+    with ThreadPoolExecutor(connections) as executor:
+        for future in [executor.submit(ping) for _ in range(connections)]:
+            future.result()
+    pinged = time.perf_counter()
+
+    with pymongo.timeout(time_left()):
+        for collection in (images_collection,
+                           groups_collection,
+                           group_stats_collection,
+                           daily_counts_collection,
+                           ):
+            collection.find_one({}, {'_id': 1})
+    queried = time.perf_counter()
+
+    _report = {
+        'connections': connections,
+        'ping_ms': round((pinged - start) * 1000, 1),
+        'queries_ms': round((queried - pinged) * 1000, 1),
+        'total_ms': round((queried - start) * 1000, 1),
+    }
+    return _report
+
+
+def warm_up_report():
+    """Return the report of the warm-up of this process or None."""
+    return _report
@@ -0,0 +1,170 @@
+"""
+Write-Behind Image Status Updates
+
+When STATUS_UPDATE_WRITE_BEHIND is enabled, PUT /images/<image_id> only puts
+the new status into a per worker queue and returns. Repeated updates of
+the same image are coalesced (the last one wins) and a background thread
+writes the queue with one bulk write every STATUS_UPDATE_FLUSH_INTERVAL
+seconds.
+
+The queue is drained on worker shutdown by the gunicorn 'worker_exit' hook
+(see gunicorn_config.py) and at interpreter exit.
+
+Updates written synchronously (conditional PUT, PATCH /images and group
+updates) first flush the pending updates of their images, so an older
+queued status can not overwrite them later. The queue is per worker, so
+this orders the writes of one worker only.
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+from models.status_updates import bulk_update_statuses
+from config.config import STATUS_UPDATE_FLUSH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+class StatusUpdateQueue:
+    """
+    Queue of pending image status updates flushed by a background thread.
+
+    Args:
+        flush_interval (float): Seconds between two flushes.
+    """
+
+    def __init__(self, flush_interval):
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._pid = None
+        # metrics
+        self.queued = 0
+        self.coalesced = 0
+        self.flushes = 0
+        self.flushed = 0
+        self.errors = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+
+    def put(self, image_id, status):
+        """
+        Queue a status update, replacing a pending update of the same image.
+
+        Args:
+            image_id (ObjectId): Image to update.
+            status (str): New valid status.
+        """
+        with self._lock:
+            if image_id in self._pending:
+                self.coalesced += 1
+            self._pending[image_id] = status
+            self.queued += 1
+            self._start()
+
+    def _start(self):
+        # threads do not survive fork, so every worker starts its own one
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        self._pid = os.getpid()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='status-update-queue',
+                                        daemon=True,
+                                        )
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            self._flush_logged()
+
+    def _flush_logged(self):
+        try:
+            self.flush()
+        except Exception:
+            # logged by flush, the updates are written next time
+            pass
+
+    def flush(self, image_ids=None):
+        """
+        Write pending updates with one bulk write.
+
+        Called before a synchronous write of images, so their older queued
+        updates are written first. An update being written by the
+        background thread at the moment is waited for.
+
+        Args:
+            image_ids (iterable): Write only pending updates of these
+                images, all of them if None.
+
+        Raises:
+            Exception: If the bulk write fails. The updates are put back
+                into the queue.
+        """
+        with self._flush_lock:
+            with self._lock:
+                if image_ids is None:
+                    batch, self._pending = self._pending, {}
+                else:
+                    batch = {image_id: self._pending.pop(image_id)
+                             for image_id in set(image_ids)
+                             if image_id in self._pending}
+            if not batch:
+                return
+
+            start = time.perf_counter()
+            try:
+                bulk_update_statuses(list(batch.items()))
+            except Exception:
+                self.errors += 1
+                logger.exception("Flush of %d status updates failed",
+                                 len(batch))
+                # put the updates back unless they were superseded
+                with self._lock:
+                    for image_id, status in batch.items():
+                        self._pending.setdefault(image_id, status)
+                raise
+
+            duration = time.perf_counter() - start
+            self.flushes += 1
+            self.flushed += len(batch)
+            self.last_flush_seconds = duration
+            self.max_flush_seconds = max(self.max_flush_seconds, duration)
+
+    def drain(self):
+        """Stop the background thread and write all pending updates."""
+        self._stopped.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join()
+        self._flush_logged()
+
+    def metrics(self):
+        """
+        Return queue metrics of this worker.
+
+        Returns:
+            dict: Current queue depth, number of queued, coalesced and
+            flushed updates, number of flushes and failed flushes and
+            the last and maximum flush latency in seconds.
+        """
+        with self._lock:
+            depth = len(self._pending)
+        return {
+            'depth': depth,
+            'queued': self.queued,
+            'coalesced': self.coalesced,
+            'flushes': self.flushes,
+            'flushed': self.flushed,
+            'errors': self.errors,
+            'last_flush_seconds': self.last_flush_seconds,
+            'max_flush_seconds': self.max_flush_seconds,
+        }
+
+
+status_update_queue = StatusUpdateQueue(STATUS_UPDATE_FLUSH_INTERVAL)
+atexit.register(status_update_queue.drain)
@@ -1,7 +1,44 @@
+import asyncio
+import base64
+import importlib.util
+import os
+import subprocess
+import sys
 import unittest
 import json
+import time
+import threading
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from datetime import datetime, timedelta
+import bson
+from pymongo import IndexModel
+from bson import ObjectId, Int64, Decimal128
 from app import app
-from config.config import VALID_STATUSES
+try:
+    from asgi_app import app as asgi_app
+    from asgi_app.db import close_client
+except ImportError:
+    # starlette and motor are needed only by the ASGI variant
+    asgi_app = None
+from config.config import VALID_STATUSES, STATISTIC_NUMBER_OF_DAYS
+from utils.raw_bson import iter_raw_documents, document_to_json
+from utils.utils import iter_json_array
+from utils.params import statistics_query, parse_statistics_params
+from models.write_behind import StatusUpdateQueue, status_update_queue
+from models.statistics_cache import StatisticsCache, statistics_cache
+from models.query_plans import plan_stages, check_query_plans
+from models.models import (db,
+                           images_collection,
+                           groups_collection,
+                           group_stats_collection,
+                           daily_counts_collection,
+                           )
+from models import group_stats, daily_counts
+from models.indexes import is_declared_in, missing_indexes, ensure_indexes
+from models.pipelines import statistics_pipeline, daily_counts_pipeline
+from models.daily_counts import to_day, rebuild_daily_counts
 
 
 class TestGroupsAPI(unittest.TestCase):
@@ -91,6 +128,216 @@ class TestGroupsAPI(unittest.TestCase):
             #                 "The method is not allowed for the requested URL.",
             #                 )
 
+    # test cursor pagination
+    def test_cursor_pagination(self):
+
+        response = self.app.get('/groups')
+        all_names = [group['name'] for group in response.get_json()]
+
+        names = []
+        cursor = ''
+        while cursor is not None:
+            response = self.app.get('/groups?groups_per_page=3&cursor='
+                                    + cursor)
+            self.assertEqual(response.status_code, 200)
+            data = response.get_json()
+            self.assertLessEqual(len(data['groups']), 3)
+            names.extend(group['name'] for group in data['groups'])
+            cursor = data['next_cursor']
+
+        self.assertEqual(names, sorted(all_names))
+
+    def test_images_per_group(self):
+
+        response = self.app.get('/groups')
+        counts = {group['name']: group['count']
+                  for group in response.get_json()}
+
+        response = self.app.get('/groups?images_per_group=1')
+        self.assertEqual(response.status_code, 200)
+        for group in response.get_json():
+            self.assertLessEqual(len(group['images']), 1)
+            self.assertEqual(group['count'], counts[group['name']])
+            self.assertEqual(group['has_more'], group['count'] > 1)
+
+        response = self.app.get('/groups?images_per_group=0')
+        self.assertEqual(response.status_code, 400)
+
+        # too large for the pipeline
+        response = self.app.get('/groups?images_per_group='
+                                '99999999999999999999')
+        self.assertEqual(response.status_code, 400)
+
+    def test_image_fields(self):
+
+        response = self.app.get('/groups')
+        image = response.get_json()[0]['images'][0]
+        self.assertNotIn('group_id', image)
+        self.assertIn('url', image)
+
+        response = self.app.get('/groups?fields=url,group_id')
+        self.assertEqual(response.status_code, 200)
+        image = response.get_json()[0]['images'][0]
+        self.assertEqual(set(image), {'_id', 'url', 'group_id'})
+
+        response = self.app.get('/groups?fields=url,password')
+        self.assertEqual(response.status_code, 400)
+
+    def test_streaming_response(self):
+
+        expected = self.app.get('/groups').get_json()
+        response = self.app.get('/groups?stream=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.get_json(), expected)
+
+    def test_ndjson_response(self):
+
+        expected = self.app.get('/groups').get_json()
+        response = self.app.get('/groups',
+                                headers={'Accept': 'application/x-ndjson'},
+                                )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line) for line in lines], expected)
+
+    def test_invalid_cursor(self):
+
+        response = self.app.get('/groups?cursor=notacursor')
+        self.assertEqual(response.status_code, 400)
+        data = response.get_json()
+        self.assertEqual(data["name"], "Invalid values of query parameters")
+
+        # query operators are not accepted as the last name or _id
+        for key in ([{'$gt': ''}, {'$oid': str(ObjectId())}],
+                    ['Group 0', {'$gt': ''}],
+                    ['Group 0', 'not an ObjectId'],
+                    # invalid extended JSON values
+                    ['Group 0', {'$oid': 'zz'}],
+                    ['Group 0', {'$date': 'xx'}],
+                    ['Group 0',
+                     {'$date': {'$numberLong': '99999999999999999999'}}]):
+            cursor = base64.urlsafe_b64encode(json.dumps(key).encode())
+            response = self.app.get('/groups?cursor=' + cursor.decode())
+            self.assertEqual(response.status_code, 400, key)
+
+
+class TestRawBSONTranscoder(unittest.TestCase):
+
+    def test_same_json_as_provider(self):
+        documents = [
+            {
+                '_id': ObjectId(),
+                'name': 'Group "0" \u00e9',
+                'count': 2,
+                'images': [
+                    {
+                        '_id': ObjectId(),
+                        'created_at': datetime(2023, 9, 17, 15, 37, 19,
+                                               276000),
+                        'last_updated_at': datetime(2023, 9, 28),
+                        'status': 'new',
+                    },
+                ],
+                'numbers': [1.5, Int64(2 ** 40), True, None],
+                'before_epoch': datetime(1960, 1, 1),
+                # keys are sorted the same as by json.dumps
+                '\u00e9t\u00e9': 1,
+                'z': 0,
+            },
+            # decimal is not transcoded directly, falls back to decoding
+            {'_id': ObjectId(), 'price': Decimal128('1.5')},
+        ]
+        raw = b''.join(bson.encode(document) for document in documents)
+
+        with app.test_request_context():
+            for document, raw_document in zip(documents,
+                                              iter_raw_documents([raw])):
+                expected = app.json.response(document).get_data(as_text=True)
+                self.assertEqual(document_to_json(raw_document) + "\n",
+                                 expected)
+
+
+class TestStreaming(unittest.TestCase):
+
+    @staticmethod
+    def make_groups(number_of_groups):
+        for group_number in range(number_of_groups):
+            yield {
+                '_id': ObjectId(),
+                'name': f"Group {group_number}",
+                'images': [
+                    {
+                        '_id': ObjectId(),
+                        'created_at': datetime.utcnow(),
+                        'status': VALID_STATUSES[image_number % 4],
+                        'url': f"https://images_service.com/{image_number}",
+                    }
+                    for image_number in range(40)
+                ],
+                'count': 40,
+            }
+
+    def peak_memory(self, number_of_groups):
+        tracemalloc.start()
+        for _ in iter_json_array(self.make_groups(number_of_groups),
+                                 app.json.dumps,
+                                 batch_size=50,
+                                 ):
+            pass
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return peak
+
+    def test_memory_does_not_depend_on_number_of_groups(self):
+        small = self.peak_memory(100)
+        large = self.peak_memory(1000)
+        self.assertLess(large, small * 1.5)
+
+    def peak_response_memory(self, number_of_groups):
+        client = app.test_client()
+        tracemalloc.start()
+        response = client.get(f'/groups?stream=1&page=0'
+                              f'&groups_per_page={number_of_groups}',
+                              buffered=False,
+                              )
+        size = sum(len(chunk) for chunk in response.response)
+        response.close()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.assertEqual(response.status_code, 200)
+        return size, peak
+
+    def test_streamed_response_memory(self):
+        # groups of about 2 kB sorted after the groups of the test database
+        groups_collection.insert_many([
+            {'name': f"~streaming test {number:05}",
+             'description': 'x' * 2000,
+             'streaming_test': True,
+             }
+            for number in range(3000)
+            ])
+        try:
+            small_size, small = self.peak_response_memory(300)
+            large_size, large = self.peak_response_memory(3000)
+        finally:
+            groups_collection.delete_many({'streaming_test': True})
+
+        # the response of the cursor and stream_with_context path
+        # is streamed batch by batch, not built in memory
+        self.assertGreater(large_size, small_size * 5)
+        self.assertLess(large, small * 1.5)
+
+    def test_json_array(self):
+        groups = list(self.make_groups(120))
+        for batch_size in (1, 50, 200):
+            chunks = iter_json_array(groups, app.json.dumps, batch_size)
+            self.assertEqual(json.loads(''.join(chunks)),
+                             json.loads(app.json.dumps(groups)))
+        self.assertEqual(''.join(iter_json_array([], app.json.dumps, 10)),
+                         '[]')
+
 
 class TestImageStatusChangeAPI(unittest.TestCase):
 
@@ -195,6 +442,516 @@ class TestImageStatusChangeAPI(unittest.TestCase):
         self.assertEqual(response.status_code, 400)
 
 
+class TestGroupStats(unittest.TestCase):
+
+    def setUp(self):
+        self.app = app.test_client()
+
+    def get_counts(self, query=''):
+        response = self.app.get('/groups?images_per_group=1' + query)
+        return {group['name']: group['count']
+                for group in response.get_json()}
+
+    def test_counts_follow_status_updates(self):
+        result = app.test_cli_runner().invoke(args=['rebuild-group-stats'])
+        self.assertEqual(result.exit_code, 0)
+
+        response = self.app.get('/groups')
+        data = response.get_json()
+        image_id = data[0]['images'][0]['_id']['$oid']
+        old_status = data[0]['images'][0]['status']
+        new_status = next(status for status in VALID_STATUSES
+                          if status != old_status)
+        old_counts = self.get_counts('&status=' + new_status)
+
+        response = self.app.put(f'/images/{image_id}',
+                                data=json.dumps({'status': new_status}),
+                                content_type='application/json',
+                                )
+        self.assertEqual(response.status_code, 200)
+
+        # counts from group_stats are the same as counted from images
+        for status in VALID_STATUSES:
+            response = self.app.get('/groups?status=' + status)
+            expected = {group['name']: group['count']
+                        for group in response.get_json()}
+            self.assertEqual(self.get_counts('&status=' + status), expected)
+        counts = self.get_counts('&status=' + new_status)
+        self.assertEqual(counts[data[0]['name']],
+                         old_counts[data[0]['name']] + 1)
+
+        # set status back
+        response = self.app.put(f'/images/{image_id}',
+                                data=json.dumps({'status': old_status}),
+                                content_type='application/json',
+                                )
+        self.assertEqual(response.status_code, 200)
+
+    def test_count_of_listed_statuses(self):
+        group_stats.rebuild_group_stats()
+        group_id = groups_collection.find_one()['_id']
+        # an image of a status which is not listed, counted in 'total'
+        image_id = images_collection.insert_one({
+            'group_id': group_id,
+            'status': 'archived',
+            'created_at': datetime.utcnow(),
+            'last_updated_at': datetime.utcnow(),
+            }).inserted_id
+        group_stats.rebuild_group_stats([group_id])
+        try:
+            expected = {group['name']: group['count']
+                        for group in self.app.get('/groups').get_json()}
+            self.assertEqual(self.get_counts(), expected)
+        finally:
+            images_collection.delete_one({'_id': image_id})
+            group_stats.rebuild_group_stats()
+
+    def test_counts_before_group_stats_are_built(self):
+        group_stats.rebuild_group_stats()
+        expected = {
+            status: {group['name']: group['count']
+                     for group in self.app.get(f'/groups?{status}').get_json()}
+            for status in ['', *(f'status={status}'
+                                 for status in VALID_STATUSES)]
+            }
+        # a database where group_stats was never built
+        group_stats_collection.delete_many({})
+        group_stats._built.clear()
+        try:
+            for status, counts in expected.items():
+                self.assertEqual(self.get_counts(f'&{status}'), counts)
+        finally:
+            group_stats.rebuild_group_stats()
+        self.assertTrue(group_stats.group_stats_built())
+        self.assertEqual(self.get_counts(), expected[''])
+
+
+class TestConcurrentStatusUpdates(unittest.TestCase):
+
+    def setUp(self):
+        self.app = app.test_client()
+
+    def test_hammer_one_image(self):
+        app.test_cli_runner().invoke(args=['rebuild-group-stats'])
+        response = self.app.get('/groups')
+        group = response.get_json()[0]
+        image_id = group['images'][0]['_id']['$oid']
+        old_status = group['images'][0]['status']
+
+        def put(number):
+            client = app.test_client()
+            status = VALID_STATUSES[number % len(VALID_STATUSES)]
+            response = client.put(f'/images/{image_id}',
+                                  data=json.dumps({'status': status}),
+                                  content_type='application/json',
+                                  )
+            return response.status_code, response.get_json()['message']
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            results = list(executor.map(put, range(400)))
+
+        # every request either updated the status or found it the same
+        for code, message in results:
+            self.assertEqual(code, 200)
+            self.assertIn(message, ['Image status updated',
+                                    'Requested status is the same as current',
+                                    ])
+
+        # no transition was lost or applied twice, so the incrementally
+        # maintained counts are the same as counted from images
+        for status in VALID_STATUSES:
+            response = self.app.get('/groups?status=' + status)
+            expected = {group['name']: group['count']
+                        for group in response.get_json()}
+            response = self.app.get('/groups?images_per_group=1&status='
+                                    + status)
+            counts = {group['name']: group['count']
+                      for group in response.get_json()}
+            self.assertEqual(counts, expected)
+
+        self.app.put(f'/images/{image_id}',
+                     data=json.dumps({'status': old_status}),
+                     content_type='application/json',
+                     )
+
+
+class TestImageVersions(unittest.TestCase):
+
+    def setUp(self):
+        self.app = app.test_client()
+
+    def test_conditional_update(self):
+        response = self.app.get('/groups')
+        image = response.get_json()[0]['images'][0]
+        url = f"/images/{image['_id']['$oid']}"
+        new_status = next(status for status in VALID_STATUSES
+                          if status != image['status'])
+
+        response = self.app.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+
+        response = self.app.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        response = self.app.put(url,
+                                json={'status': new_status},
+                                headers={'If-Match': etag},
+                                )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        new_etag = response.headers['ETag']
+
+        # stale version is rejected
+        response = self.app.put(url,
+                                json={'status': image['status']},
+                                headers={'If-Match': etag},
+                                )
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(response.get_json()['name'], "Precondition Failed")
+
+        response = self.app.put(url,
+                                json={'status': image['status']},
+                                headers={'If-Match': new_etag},
+                                )
+        self.assertEqual(response.status_code, 200)
+
+    def test_get_image_not_found(self):
+        response = self.app.get('/images/123456789012345678901234')
+        self.assertEqual(response.status_code, 404)
+
+
+class TestBulkStatusUpdate(unittest.TestCase):
+
+    def setUp(self):
+        self.app = app.test_client()
+
+    def test_bulk_update(self):
+        response = self.app.get('/groups')
+        images = response.get_json()[0]['images'][:2]
+        first, second = (image['_id']['$oid'] for image in images)
+        non_existing = '123456789012345678901234'
+
+        response = self.app.patch('/images', json=[
+            {'id': first, 'status': 'accepted'},
+            {'id': second, 'status': images[1]['status']},
+            {'id': non_existing, 'status': 'new'},
+            ])
+        self.assertEqual(response.status_code, 200)
+        answer = response.get_json()
+        self.assertEqual(answer['results'], [
+            {'id': first, 'result': ('unchanged'
+                                     if images[0]['status'] == 'accepted'
+                                     else 'updated')},
+            {'id': second, 'result': 'unchanged'},
+            {'id': non_existing, 'result': 'not_found'},
+            ])
+
+        # set status back
+        response = self.app.patch('/images', json=[
+            {'id': first, 'status': images[0]['status']},
+            ])
+        self.assertEqual(response.status_code, 200)
+
+    def test_bulk_update_invalid_items(self):
+        response = self.app.get('/groups')
+        image = response.get_json()[0]['images'][0]
+
+        response = self.app.patch('/images', json=[
+            {'id': image['_id']['$oid'], 'status': 'accepted'},
+            {'id': 'notvalidatall', 'status': 'new'},
+            {'id': image['_id']['$oid'], 'status': 'invalid'},
+            ])
+        answer = response.get_json()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(answer['name'], "Invalid items")
+        self.assertIn("Item 1", answer['description'])
+        self.assertIn("Item 2", answer['description'])
+
+        # nothing was updated
+        response = self.app.get('/groups')
+        self.assertEqual(response.get_json()[0]['images'][0]['status'],
+                         image['status'])
+
+
+class TestGroupStatusUpdate(unittest.TestCase):
+
+    def setUp(self):
+        self.app = app.test_client()
+
+    def get_group(self, group_id):
+        response = self.app.get('/groups')
+        return next(group for group in response.get_json()
+                    if group['_id']['$oid'] == group_id)
+
+    def test_update_group_images_status(self):
+        response = self.app.get('/groups')
+        group = response.get_json()[0]
+        group_id = group['_id']['$oid']
+        statuses = {image['_id']['$oid']: image['status']
+                    for image in group['images']}
+        number_in_review = list(statuses.values()).count('review')
+
+        response = self.app.put(f'/groups/{group_id}/images/status',
+                                json={'status': 'accepted',
+                                      'from_status': 'review'},
+                                )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['updated'], number_in_review)
+
+        for image in self.get_group(group_id)['images']:
+            expected = statuses[image['_id']['$oid']]
+            if expected == 'review':
+                expected = 'accepted'
+            self.assertEqual(image['status'], expected)
+
+        # set statuses back
+        response = self.app.patch('/images', json=[
+            {'id': image_id, 'status': status}
+            for image_id, status in statuses.items()
+            ])
+        self.assertEqual(response.status_code, 200)
+
+    def test_counts_follow_group_update(self):
+        group_stats.rebuild_group_stats()
+        rebuild_daily_counts()
+        group = self.app.get('/groups').get_json()[0]
+        group_id = ObjectId(group['_id']['$oid'])
+        statuses = {image['_id']['$oid']: image['status']
+                    for image in group['images']}
+
+        # images of all statuses move to one
+        response = self.app.put(f'/groups/{group_id}/images/status',
+                                json={'status': 'deleted'},
+                                )
+        self.assertEqual(response.status_code, 200)
+        try:
+            expected = {}
+            for status in VALID_STATUSES:
+                count = images_collection.count_documents(
+                    {'group_id': group_id, 'status': status},
+                    )
+                if count:
+                    expected[status] = count
+            counts = group_stats_collection.find_one({'_id': group_id})
+            self.assertEqual({status: count
+                              for status, count in counts['counts'].items()
+                              if count},
+                             expected)
+            start = to_day(datetime.utcnow()) - timedelta(days=366)
+            end = to_day(datetime.utcnow()) + timedelta(days=1)
+            self.assertEqual(
+                {item['_id']: item['count']
+                 for item in daily_counts_collection.aggregate(
+                     daily_counts_pipeline(start, end))},
+                {item['_id']: item['count']
+                 for item in images_collection.aggregate(
+                     statistics_pipeline(start, end))},
+                )
+        finally:
+            # set statuses back
+            response = self.app.patch('/images', json=[
+                {'id': image_id, 'status': status}
+                for image_id, status in statuses.items()
+                ])
+            self.assertEqual(response.status_code, 200)
+
+    def test_update_group_images_status_invalid(self):
+        response = self.app.put('/groups/notvalidatall/images/status',
+                                json={'status': 'accepted'},
+                                )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['name'], "Invalid ObjectId")
+
+        response = self.app.put(
+            '/groups/123456789012345678901234/images/status',
+            json={'status': 'accepted'},
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['name'], "Group not found")
+
+        response = self.app.get('/groups')
+        group_id = response.get_json()[0]['_id']['$oid']
+        response = self.app.put(f'/groups/{group_id}/images/status',
+                                json={'status': 'accepted',
+                                      'from_status': 'invalid'},
+                                )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['name'], "Invalid status")
+
+
+class TestWriteBehindQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.app = app.test_client()
+
+    def test_coalesce_and_drain(self):
+        response = self.app.get('/groups')
+        image = response.get_json()[0]['images'][0]
+        image_id = ObjectId(image['_id']['$oid'])
+
+        queue = StatusUpdateQueue(flush_interval=60)
+        for number in range(100):
+            queue.put(image_id, VALID_STATUSES[number % 4])
+        queue.put(image_id, 'accepted')
+        self.assertEqual(queue.metrics()['depth'], 1)
+        self.assertEqual(queue.metrics()['coalesced'], 100)
+
+        # nothing is written before the flush
+        response = self.app.get('/groups')
+        self.assertEqual(response.get_json()[0]['images'][0]['status'],
+                         image['status'])
+
+        queue.drain()
+        metrics = queue.metrics()
+        self.assertEqual(metrics['depth'], 0)
+        self.assertEqual(metrics['flushes'], 1)
+        self.assertEqual(metrics['flushed'], 1)
+        response = self.app.get('/groups?fields=status&status=accepted')
+        self.assertIn(image['_id'],
+                      [image['_id'] for group in response.get_json()
+                       for image in group['images']])
+
+        # set status back
+        self.app.put(f"/images/{image['_id']['$oid']}",
+                     data=json.dumps({'status': image['status']}),
+                     content_type='application/json',
+                     )
+
+    def test_synchronous_write_after_queued(self):
+        response = self.app.get('/groups')
+        image = response.get_json()[0]['images'][0]
+        image_id = ObjectId(image['_id']['$oid'])
+        url = f"/images/{image['_id']['$oid']}"
+        queued_status, new_status = [status for status in VALID_STATUSES
+                                     if status != image['status']][:2]
+
+        try:
+            for write in [
+                    lambda: self.app.patch('/images', json=[
+                        {'id': str(image_id), 'status': new_status}]),
+                    lambda: self.app.put(url,
+                                         json={'status': new_status},
+                                         headers={'If-Match': '*'},
+                                         ),
+                    ]:
+                # the queued update is older than the synchronous one
+                status_update_queue.put(image_id, queued_status)
+                self.assertEqual(write().status_code, 200)
+                status_update_queue.flush()
+                response = self.app.get(url)
+                self.assertEqual(response.get_json()['status'], new_status)
+
+                self.app.patch('/images', json=[
+                    {'id': str(image_id), 'status': image['status']}])
+        finally:
+            status_update_queue.flush()
+            self.app.patch('/images', json=[
+                {'id': str(image_id), 'status': image['status']}])
+
+    def test_metrics_endpoint(self):
+        response = self.app.get('/images/status-queue')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('depth', response.get_json())
+        self.assertIn('last_flush_seconds', response.get_json())
+
+
+class TestStatisticsCache(unittest.TestCase):
+
+    def test_move_image(self):
+        cache = StatisticsCache(ttl=60, max_entries=3)
+        start, end = datetime(2023, 9, 1), datetime(2023, 10, 1)
+        cache.put('totals', start, end, None, {'new': 1, 'accepted': 2})
+        cache.put('days', start, end, 'day', [
+            {'start': datetime(2023, 9, 4), 'counts': {'new': 1}},
+            {'start': datetime(2023, 9, 5), 'counts': {'accepted': 2}},
+            ])
+
+        group_id = ObjectId()
+        cache.put('group', start, end, None, {'new': 1}, ObjectId())
+
+        cache.move_image(datetime(2023, 9, 4, 12), group_id, 'new',
+                         'accepted', cache.begin_write())
+        # images created outside of the period are not counted
+        cache.move_image(datetime(2023, 10, 4), group_id, 'accepted', 'new',
+                         cache.begin_write())
+
+        self.assertEqual(cache.get('totals'),
+                         (start, end, {'accepted': 3}))
+        self.assertEqual(cache.get('days')[2], [
+            {'start': datetime(2023, 9, 4), 'counts': {'accepted': 1}},
+            {'start': datetime(2023, 9, 5), 'counts': {'accepted': 2}},
+            ])
+        # nor images of other groups
+        self.assertEqual(cache.get('group')[2], {'new': 1})
+
+        cache.put('weeks', start, end, 'week', [])
+        self.assertIsNone(cache.get('totals'))
+
+    def test_read_during_update(self):
+        cache = StatisticsCache(ttl=60, max_entries=10)
+        start, end = datetime(2023, 9, 1), datetime(2023, 10, 1)
+        created_at, group_id = datetime(2023, 9, 4), ObjectId()
+
+        # an update begins while the result is read
+        generation = cache.begin_read()
+        write = cache.begin_write()
+        cache.put('totals', start, end, None, {'accepted': 1}, None,
+                  generation)
+        self.assertIsNone(cache.get('totals'))
+
+        # the result is read after the update began, it may count the
+        # image already, so it is dropped instead of being moved
+        cache.put('totals', start, end, None, {'accepted': 1}, None,
+                  cache.begin_read())
+        cache.move_image(created_at, group_id, 'new', 'accepted', write)
+        self.assertIsNone(cache.get('totals'))
+
+        # a result read before the update is moved
+        cache.put('totals', start, end, None, {'new': 1}, None,
+                  cache.begin_read())
+        cache.move_image(created_at, group_id, 'new', 'accepted',
+                         cache.begin_write())
+        self.assertEqual(cache.get('totals')[2], {'accepted': 1})
+
+        # nor results read while the cache is cleared are cached
+        generation = cache.begin_read()
+        cache.clear()
+        cache.put('totals', start, end, None, {'new': 1}, None, generation)
+        self.assertIsNone(cache.get('totals'))
+
+    def test_ttl(self):
+        cache = StatisticsCache(ttl=0.05, max_entries=10)
+        cache.put('totals', datetime.min, datetime.max, None, {})
+        self.assertIsNotNone(cache.get('totals'))
+        time.sleep(0.1)
+        self.assertIsNone(cache.get('totals'))
+
+        cache = StatisticsCache(ttl=0, max_entries=10)
+        cache.put('totals', datetime.min, datetime.max, None, {})
+        self.assertIsNone(cache.get('totals'))
+
+    def test_failed_update_of_committed_status(self):
+        client = app.test_client()
+        image = images_collection.find_one({'status': 'new'})
+        url = f"/images/{image['_id']}"
+        # a cached result the status update can not be applied to
+        statistics_cache.put('broken', datetime.min, datetime.max, None, None)
+        try:
+            with self.assertLogs('models.status_updates', 'ERROR'):
+                response = client.put(url, json={'status': 'review'})
+            # the update is committed, so it is reported as done
+            # and the cache is dropped instead
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                images_collection.find_one({'_id': image['_id']})['status'],
+                'review',
+                )
+            self.assertIsNone(statistics_cache.get('broken'))
+        finally:
+            client.put(url, json={'status': 'new'})
+
+
 class TestImageStatistics(unittest.TestCase):
 
     def setUp(self):
@@ -257,6 +1014,501 @@ class TestImageStatistics(unittest.TestCase):
         self.assertEqual(answer['new'],  new)
         self.assertEqual(answer['accepted'],  accepted)
 
+    def test_get_statistics_ndjson(self):
+        expected = self.app.get('/statistics').get_json()
+        response = self.app.get('/statistics',
+                                headers={'Accept': 'application/x-ndjson'},
+                                )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = [json.loads(line)
+                 for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual({line['status']: line['count'] for line in lines},
+                         expected)
+
+    def test_rollup_matches_images(self):
+        rebuild_daily_counts()
+        end_day = to_day(datetime.utcnow()) + timedelta(days=1)
+        start_day = end_day - timedelta(days=STATISTIC_NUMBER_OF_DAYS)
+        rollup = {
+            item['_id']: item['count']
+            for item in daily_counts_collection.aggregate(
+                daily_counts_pipeline(start_day, end_day)
+                )
+            }
+        counted = {
+            item['_id']: item['count']
+            for item in images_collection.aggregate(
+                statistics_pipeline(start_day, end_day)
+                )
+            }
+        self.assertEqual(rollup, counted)
+
+    def test_statistics_before_daily_counts_are_built(self):
+        rebuild_daily_counts()
+        statistics_cache.clear()
+        expected = self.app.get('/statistics').get_json()
+        # a database where daily_status_counts was never built, with
+        # the delta of a status update written before the rebuild
+        daily_counts_collection.delete_many({})
+        daily_counts._built.clear()
+        daily_counts_collection.insert_one({
+            'day': to_day(datetime.utcnow()),
+            'status': VALID_STATUSES[0],
+            'count': -1,
+            })
+        try:
+            statistics_cache.clear()
+            self.assertEqual(self.app.get('/statistics').get_json(),
+                             expected)
+        finally:
+            rebuild_daily_counts()
+        self.assertTrue(daily_counts.daily_counts_built())
+        statistics_cache.clear()
+        self.assertEqual(self.app.get('/statistics').get_json(), expected)
+
+    def test_statistics_query_over_images(self):
+        # not midnight, so the images are counted with the index hint
+        end = datetime.utcnow().replace(minute=30)
+        start = end - timedelta(days=STATISTIC_NUMBER_OF_DAYS)
+        for bucket in (None, 'hour', 'day'):
+            use_daily_counts, pipeline, options = statistics_query(
+                start, end, bucket, None,
+                )
+            self.assertFalse(use_daily_counts)
+            self.assertEqual(
+                list(images_collection.aggregate(pipeline, **options)),
+                list(images_collection.aggregate(pipeline)),
+                )
+            explain = db.command('explain', {
+                'aggregate': images_collection.name,
+                'pipeline': pipeline,
+                'cursor': {},
+                **options,
+                })
+            self.assertNotIn('FETCH', plan_stages(explain))
+
+        # the recount of single days uses the same hint
+        rebuild_daily_counts(days=[end])
+        day = to_day(end)
+        next_day = day + timedelta(days=1)
+        self.assertEqual(
+            {item['_id']: item['count']
+             for item in daily_counts_collection.aggregate(
+                 daily_counts_pipeline(day, next_day)
+                 )},
+            {item['_id']: item['count']
+             for item in images_collection.aggregate(
+                 statistics_pipeline(day, next_day)
+                 )},
+            )
+
+    def test_get_statistics_histogram(self):
+        total = self.app.get('/statistics?days=7').get_json()
+        for bucket in ('hour', 'day', 'week'):
+            response = self.app.get(f'/statistics?days=7&bucket={bucket}')
+            self.assertEqual(response.status_code, 200)
+            answer = response.get_json()
+            self.assertEqual(answer['bucket'], bucket)
+            starts = [item['start']['$date'] for item in answer['series']]
+            self.assertEqual(starts, sorted(starts))
+            summed = {}
+            for item in answer['series']:
+                for status, count in item['counts'].items():
+                    summed[status] = summed.get(status, 0) + count
+            if bucket != 'hour':
+                self.assertEqual(summed, total)
+
+        response = self.app.get(
+            '/statistics?from=2000-01-01&to=2000-02-01&bucket=week'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['series'], [])
+
+    def test_get_group_statistics(self):
+        total = self.app.get('/statistics').get_json()
+        summed = {}
+        for group in self.app.get('/groups').get_json():
+            group_id = group['_id']['$oid']
+            response = self.app.get(f'/groups/{group_id}/statistics')
+            self.assertEqual(response.status_code, 200)
+            answer = response.get_json()
+            self.assertEqual(
+                self.app.get(f'/statistics?group_id={group_id}').get_json(),
+                answer,
+                )
+            for status, count in answer.items():
+                summed[status] = summed.get(status, 0) + count
+        self.assertEqual(summed, total)
+
+        response = self.app.get(
+            '/groups/123456789012345678901234/statistics'
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['name'], "Group not found")
+        response = self.app.get('/groups/notvalidatall/statistics')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['name'], "Invalid ObjectId")
+
+    def test_group_statistics_match_images(self):
+        period = parse_statistics_params({})
+        created_at = {'$gte': period['start_date'], '$lt': period['end_date']}
+        for group in groups_collection.find({}, {'_id': 1}).limit(3):
+            group_id = group['_id']
+            response = self.app.get(f'/groups/{group_id}/statistics')
+            self.assertEqual(response.status_code, 200)
+            expected = {}
+            for status in VALID_STATUSES:
+                count = images_collection.count_documents({
+                    'group_id': group_id,
+                    'status': status,
+                    'created_at': created_at,
+                    })
+                if count:
+                    expected[status] = count
+            self.assertEqual(response.get_json(), expected)
+
+            response = self.app.get(
+                f'/groups/{group_id}/statistics?days=2&bucket=hour'
+                )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.get_json()['bucket'], 'hour')
+
+    def test_get_statistics_invalid_parameters(self):
+        for query in ('days=0', 'days=abc', 'bucket=month',
+                      'from=yesterday', 'from=2023-02-01&to=2023-01-01',
+                      'days=7&from=2023-01-01', 'days=1000000',
+                      'to=0001-01-05&days=30', 'to=0001-01-05',
+                      'from=0001-01-01T00:00:00+01:00'):
+            response = self.app.get(f'/statistics?{query}')
+            self.assertEqual(response.status_code, 400, query)
+            self.assertEqual(response.get_json()['name'],
+                             "Invalid values of query parameters")
+
+
+class TestQueryPlans(unittest.TestCase):
+
+    def test_plan_stages(self):
+        explain = {
+            'queryPlanner': {
+                'winningPlan': {
+                    'stage': 'PROJECTION_COVERED',
+                    'inputStage': {'stage': 'IXSCAN'},
+                },
+                'rejectedPlans': [{'stage': 'COLLSCAN'}],
+            },
+            'stages': [{'$lookup': {}, 'collectionScans': 1}],
+        }
+        self.assertEqual(plan_stages(explain),
+                         {'PROJECTION_COVERED', 'IXSCAN', 'COLLSCAN'})
+
+    def test_no_regressions(self):
+        for name, stages, problem in check_query_plans():
+            self.assertIsNone(problem, f"{name}: {stages}")
+
+
+class TestReadiness(unittest.TestCase):
+
+    def setUp(self):
+        self.app = app.test_client()
+
+    def test_ready(self):
+        response = self.app.get('/healthz/ready')
+        self.assertEqual(response.status_code, 200)
+        answer = response.get_json()
+        self.assertEqual(answer['status'], 'ready')
+        self.assertGreaterEqual(answer['warm_up']['connections'], 1)
+        self.assertIn('total_ms', answer['warm_up'])
+
+    def test_broken_warm_up(self):
+        with mock.patch('app.views.warm_up_report', return_value=None), \
+                mock.patch('app.views.warm_up',
+                           side_effect=threading.BrokenBarrierError):
+            response = self.app.get('/healthz/ready')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.get_json()['name'], "Not ready")
+
+    def test_warm_up_timeout(self):
+        # nothing listens on port 1, the server selection timeout of the
+        # client is 30 seconds
+        script = (
+            "import time\n"
+            "from pymongo.errors import PyMongoError\n"
+            "from models.warmup import warm_up\n"
+            "start = time.monotonic()\n"
+            "try:\n"
+            "    warm_up()\n"
+            "except PyMongoError as err:\n"
+            "    print(type(err).__name__, time.monotonic() - start)\n"
+            )
+        backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ,
+                   MONGODB_URI='mongodb://127.0.0.1:1',
+                   MONGODB_WARM_UP_TIMEOUT='1',
+                   )
+        result = subprocess.run([sys.executable, '-c', script],
+                                cwd=backend,
+                                env=env,
+                                capture_output=True,
+                                text=True,
+                                timeout=60,
+                                )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        error, seconds = result.stdout.split()
+        self.assertEqual(error, 'ServerSelectionTimeoutError')
+        self.assertLess(float(seconds), 5)
+
+
+class TestIndexes(unittest.TestCase):
+
+    def test_is_declared_in(self):
+        index = IndexModel([("day", 1), ("status", 1)], unique=True)
+        information = {
+            '_id_': {'key': [('_id', 1)]},
+            'day_1_status_1': {'key': [('day', 1.0), ('status', 1.0)]},
+        }
+        # same keys but not unique
+        self.assertFalse(is_declared_in(index, information))
+        information['day_1_status_1']['unique'] = True
+        self.assertTrue(is_declared_in(index, information))
+
+    def test_ensure_indexes(self):
+        ensure_indexes(db)
+        self.assertEqual(missing_indexes(db), [])
+
+
+@unittest.skipIf(asgi_app is None, "starlette or motor is not installed")
+class TestASGIApp(unittest.TestCase):
+    """The ASGI variant answers the same as the Flask application."""
+
+    @classmethod
+    def setUpClass(cls):
+        # the Motor client is bound to the event loop it was first used on
+        cls.loop = asyncio.new_event_loop()
+
+    @classmethod
+    def tearDownClass(cls):
+        close_client()
+        cls.loop.close()
+
+    def setUp(self):
+        self.app = app.test_client()
+
+    def call(self, method, url, headers=(), body=b''):
+        """Send a request straight to the ASGI application."""
+        path, _, query = url.partition('?')
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': method,
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': query.encode(),
+            'root_path': '',
+            'headers': [(name.lower().encode(), value.encode())
+                        for name, value in headers],
+            'client': ('127.0.0.1', 50000),
+            'server': ('127.0.0.1', 80),
+        }
+        messages = [{'type': 'http.request', 'body': body}]
+        response = {'body': b''}
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            # the client stays connected until the response is sent
+            await asyncio.Event().wait()
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+                response['headers'] = {name.decode(): value.decode()
+                                       for name, value in message['headers']}
+            else:
+                response['body'] += message.get('body', b'')
+
+        self.loop.run_until_complete(asgi_app(scope, receive, send))
+        return response
+
+    def assertSameResponse(self, method, url, headers=(), body=b''):
+        expected = self.app.open(url, method=method, headers=list(headers),
+                                 data=body,
+                                 )
+        response = self.call(method, url, headers, body)
+        self.assertEqual(response['status'], expected.status_code)
+        self.assertEqual(response['headers'].get('content-type'),
+                         expected.headers.get('Content-Type'))
+        self.assertEqual(response['headers'].get('etag'),
+                         expected.headers.get('ETag'))
+        self.assertEqual(response['body'], expected.get_data())
+        return response
+
+    def test_same_groups(self):
+        ndjson = [('Accept', 'application/x-ndjson')]
+        for url in ['/groups',
+                    '/groups?page=1&groups_per_page=2',
+                    '/groups?cursor=&groups_per_page=3&images_per_group=2',
+                    '/groups?stream=1&status=new&fields=url,status',
+                    '/groups?page=-1',
+                    '/groups?status=wrong',
+                    ]:
+            with self.subTest(url=url):
+                self.assertSameResponse('GET', url)
+                self.assertSameResponse('GET', url, ndjson)
+
+    def test_same_statistics(self):
+        group_id = self.app.get('/groups').get_json()[0]['_id']['$oid']
+        for url in ['/statistics',
+                    '/statistics?days=7&bucket=day',
+                    # counted over images
+                    '/statistics?from=2023-01-01T12:00&to=2023-02-01',
+                    '/statistics?from=2023-01-01&to=2023-02-01&bucket=hour',
+                    '/statistics?from=2023-01-01&to=2023-02-01&bucket=week',
+                    f'/statistics?group_id={group_id}',
+                    '/statistics?bucket=month',
+                    '/statistics?group_id=wrong',
+                    f'/groups/{group_id}/statistics?days=3',
+                    ]:
+            with self.subTest(url=url):
+                self.assertSameResponse('GET', url)
+
+    def test_same_errors(self):
+        self.assertSameResponse('GET', '/wrong_end_point')
+        self.assertSameResponse('POST', '/statistics')
+        self.assertSameResponse('PUT', '/images/wrong',
+                                [('Content-Type', 'application/json')],
+                                b'{"status": "new"}',
+                                )
+        self.assertSameResponse('PUT', f'/images/{ObjectId()}',
+                                [('Content-Type', 'application/json')],
+                                b'{"status": "wrong"}',
+                                )
+        self.assertSameResponse('PUT', f'/images/{ObjectId()}',
+                                [('Content-Type', 'application/json')],
+                                b'{"status"',
+                                )
+
+    def test_update_image_status(self):
+        image = self.app.get('/groups').get_json()[0]['images'][0]
+        image_id = image['_id']['$oid']
+        status = image['status']
+        other = next(s for s in VALID_STATUSES if s != status)
+        json_body = [('Content-Type', 'application/json')]
+
+        # current status is not changed and returns the current version
+        version = self.app.put(f'/images/{image_id}',
+                               json={'status': status},
+                               ).headers['ETag']
+        response = self.assertSameResponse(
+            'PUT', f'/images/{image_id}', json_body,
+            json.dumps({'status': status}).encode(),
+            )
+        self.assertEqual(response['headers']['etag'], version)
+
+        # change the status with the ASGI application and back with Flask
+        response = self.call('PUT', f'/images/{image_id}',
+                             json_body + [('If-Match', version)],
+                             json.dumps({'status': other}).encode(),
+                             )
+        self.assertEqual(response['status'], 200)
+        self.assertEqual(json.loads(response['body']),
+                         {'message': 'Image status updated'})
+        response = self.app.put(f'/images/{image_id}',
+                                json={'status': status},
+                                headers={'If-Match': response['headers']
+                                         ['etag']},
+                                )
+        self.assertEqual(response.status_code, 200)
+
+        # the old version does not match any more
+        response = self.call('PUT', f'/images/{image_id}',
+                             json_body + [('If-Match', version)],
+                             json.dumps({'status': other}).encode(),
+                             )
+        self.assertEqual(response['status'], 412)
+
+
+@unittest.skipIf(importlib.util.find_spec('gevent') is None,
+                 "gevent is not installed")
+class TestGeventWorker(unittest.TestCase):
+    """The gevent worker profile patches before pymongo is imported."""
+
+    # a gunicorn worker boot: post_fork hook, then concurrent requests
+    SCRIPT = '''
+import json
+import gunicorn_config
+
+
+class Log:
+
+    def info(self, *args):
+        pass
+
+    def exception(self, *args):
+        raise
+
+
+class Server:
+    log = Log()
+
+
+class Worker:
+    pid = 0
+
+
+gunicorn_config.post_fork(Server(), Worker())
+
+import gevent
+import gevent.ssl
+from gevent import monkey
+from pymongo import ssl_context
+from models.models import get_client, get_client_options
+
+in_flight = {'now': 0, 'max': 0}
+
+
+def ping():
+    in_flight['now'] += 1
+    in_flight['max'] = max(in_flight['max'], in_flight['now'])
+    get_client().admin.command('ping')
+    in_flight['now'] -= 1
+
+
+gevent.joinall([gevent.spawn(ping) for _ in range(20)], raise_error=True)
+print(json.dumps({
+    'patched': all(monkey.is_module_patched(name)
+                   for name in ('socket', 'ssl', 'threading')),
+    'ssl_context': ssl_context.SSLContext is gevent.ssl.SSLContext,
+    'max_pool_size': get_client_options()['maxPoolSize'],
+    'in_flight': in_flight['max'],
+}))
+'''
+
+    def test_driver_cooperates(self):
+        backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ,
+                   GUNICORN_WORKER_CLASS='gevent',
+                   GUNICORN_WORKER_CONNECTIONS='50',
+                   )
+        result = subprocess.run([sys.executable, '-c', self.SCRIPT],
+                                cwd=backend,
+                                env=env,
+                                capture_output=True,
+                                text=True,
+                                timeout=60,
+                                )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        answer = json.loads(result.stdout.splitlines()[-1])
+        self.assertTrue(answer['patched'])
+        # pymongo was imported after patching, so its TLS sockets
+        # are gevent ones
+        self.assertTrue(answer['ssl_context'])
+        self.assertEqual(answer['max_pool_size'], 51)
+        # a greenlet waiting for MongoDB lets the others run
+        self.assertGreater(answer['in_flight'], 1)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,253 @@
+"""
+Request Parameters of the Endpoints
+
+Parses query parameters and headers of /groups, /images and /statistics
+into database queries. Shared by the Flask views (app/views.py) and the
+ASGI variant (asgi_app/views.py), so both answer the same requests with
+the same responses. Functions take plain mappings and werkzeug header
+objects, not a framework request.
+
+Invalid values raise ValueError with a message for the client, the views
+return it as "Invalid values of query parameters".
+"""
+
+from datetime import datetime, timedelta, timezone
+from markupsafe import escape
+from models.daily_counts import to_day
+from models.pipelines import (statistics_pipeline,
+                              daily_counts_pipeline,
+                              statistics_hint,
+                              )
+from utils.utils import decode_cursor
+from config.config import (IMAGE_FIELDS,
+                           NDJSON_MIMETYPE,
+                           STATISTIC_NUMBER_OF_DAYS,
+                           STATISTIC_MAX_NUMBER_OF_DAYS,
+                           STATISTICS_ENGINE,
+                           STATISTICS_BUCKETS,
+                           DEFAULT_PAGINATION_NUMBER_OF_GROUPS_TO_RETURN,
+                           MAX_IMAGES_PER_GROUP,
+                           )
+
+
+def parse_groups_params(args):
+    """
+    Parse pagination and projection parameters of /groups.
+
+    Args:
+        args (Mapping): Query parameters.
+
+    Returns:
+        dict: 'after', 'skip', 'limit', 'images_per_group' and 'fields'
+        keyword arguments of groups_pipeline.
+
+    Raises:
+        ValueError: If a parameter has an invalid value.
+    """
+    groups_per_page = (args.get('groups_per_page')
+                       or DEFAULT_PAGINATION_NUMBER_OF_GROUPS_TO_RETURN)
+    page_to_return = args.get('page')
+    cursor = args.get('cursor')
+    images_per_group = args.get('images_per_group')
+    fields = args.get('fields')
+
+    # groups are paginated before they are joined with images
+    # so a page costs the same whatever the number of groups is
+    skip, limit, after = None, None, None
+    if cursor is not None or page_to_return:
+        limit = int(escape(groups_per_page))
+        if limit < 1:
+            raise ValueError(
+                f"groups_per_page must be positive - {limit}"
+                )
+    if cursor:
+        after = decode_cursor(cursor)
+    elif cursor is None and page_to_return:
+        skip = int(escape(page_to_return)) * limit
+        if skip < 0:
+            raise ValueError(
+                f"page must not be negative - {page_to_return}"
+                )
+    if images_per_group is not None:
+        images_per_group = int(escape(images_per_group))
+        if images_per_group < 1:
+            raise ValueError(
+                f"images_per_group must be positive - {images_per_group}"
+                )
+        if images_per_group > MAX_IMAGES_PER_GROUP:
+            raise ValueError(f"images_per_group must be at most "
+                             f"{MAX_IMAGES_PER_GROUP} - {images_per_group}"
+                             )
+    if fields is not None:
+        fields = [str(field).strip()
+                  for field in escape(fields).split(',')]
+        unknown = [field for field in fields if field not in IMAGE_FIELDS]
+        if unknown:
+            raise ValueError(
+                f"Unknown image fields {unknown}, "
+                f"valid fields are - {IMAGE_FIELDS}"
+                )
+
+    return {
+        'after': after,
+        'skip': skip,
+        'limit': limit,
+        'images_per_group': images_per_group,
+        'fields': fields,
+    }
+
+
+def parse_statistics_params(args):
+    """
+    Parse the period and bucket parameters of /statistics.
+
+    Args:
+        args (Mapping): Query parameters.
+
+    Returns:
+        dict: 'key' (the parameters identifying the query for caching),
+        'bucket', 'start_date' and 'end_date' (excluded) of the period.
+
+    Raises:
+        ValueError: If a parameter has an invalid value.
+    """
+    days = args.get('days')
+    date_from = args.get('from')
+    date_to = args.get('to')
+    bucket = args.get('bucket')
+
+    if bucket is not None and bucket not in STATISTICS_BUCKETS:
+        raise ValueError(f"bucket must be one of {STATISTICS_BUCKETS}"
+                         f" - {escape(bucket)}"
+                         )
+    if days is not None:
+        if date_from is not None or date_to is not None:
+            raise ValueError("days can not be combined with from and to")
+        days = int(escape(days))
+        if days < 1:
+            raise ValueError(f"days must be positive - {days}")
+        if days > STATISTIC_MAX_NUMBER_OF_DAYS:
+            raise ValueError(f"days must be at most "
+                             f"{STATISTIC_MAX_NUMBER_OF_DAYS} - {days}"
+                             )
+    else:
+        days = STATISTIC_NUMBER_OF_DAYS
+    try:
+        if date_from is not None or date_to is not None:
+            end_date = (parse_date(date_to, 'to') if date_to is not None
+                        else datetime.utcnow())
+            start_date = (parse_date(date_from, 'from')
+                          if date_from is not None
+                          else end_date - timedelta(days=days))
+            if start_date >= end_date:
+                raise ValueError("from must be before to")
+        elif STATISTICS_ENGINE == 'rollup' and bucket != 'hour':
+            # the last days, including today
+            end_date = to_day(datetime.utcnow()) + timedelta(days=1)
+            start_date = end_date - timedelta(days=days)
+        else:
+            end_date = datetime.utcnow()
+            start_date = end_date - timedelta(days=days)
+    except OverflowError:
+        # e.g. 'to' in the first days of the year 1
+        raise ValueError("The period must be between the years 1 and 9999"
+                         ) from None
+
+    return {
+        'key': (days, date_from, date_to, bucket),
+        'bucket': bucket,
+        'start_date': start_date,
+        'end_date': end_date,
+    }
+
+
+def statistics_query(start_date, end_date, bucket, group_id,
+                     daily_counts_built=True):
+    """
+    Choose the collection and build the aggregation of /statistics.
+
+    Daily counts answer periods of whole days without reading images,
+    they are not kept per group and per hour.
+
+    Args:
+        start_date (datetime): Start of the period.
+        end_date (datetime): End (excluded) of the period.
+        bucket (str | None): Bucket of the histogram.
+        group_id (ObjectId | None): Group to count images of.
+        daily_counts_built (bool): The daily_status_counts collection
+            was built, images are counted otherwise.
+
+    Returns:
+        tuple: (use_daily_counts, pipeline, options), options are keyword
+        arguments of 'aggregate'.
+    """
+    if (group_id is None and STATISTICS_ENGINE == 'rollup'
+            and daily_counts_built
+            and bucket != 'hour'
+            and start_date == to_day(start_date)
+            and end_date == to_day(end_date)):
+        return True, daily_counts_pipeline(start_date, end_date, bucket), {}
+    pipeline = statistics_pipeline(start_date, end_date, bucket, group_id)
+    return False, pipeline, {'hint': statistics_hint(group_id)}
+
+
+def parse_date(value, name):
+    """
+    Parse an ISO 8601 date or datetime query parameter.
+
+    Args:
+        value (str): Value of the parameter.
+        name (str): Name of the parameter for the error message.
+
+    Returns:
+        datetime: Naive UTC datetime.
+
+    Raises:
+        ValueError: If the value is not an ISO 8601 date or datetime.
+    """
+    try:
+        date = datetime.fromisoformat(value)
+        if date.tzinfo is not None:
+            date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    except (ValueError, OverflowError):
+        raise ValueError(
+            f"{name} must be an ISO 8601 date or datetime - {escape(value)}"
+            ) from None
+    return date
+
+
+def prefers_ndjson(accept_mimetypes):
+    """
+    Check if the client asked for NDJSON (JSON Lines) in Accept header.
+
+    Args:
+        accept_mimetypes (werkzeug.datastructures.MIMEAccept): Parsed
+            Accept header.
+
+    Returns:
+        bool: True if application/x-ndjson is preferred over
+        application/json.
+    """
+    best = accept_mimetypes.best_match(['application/json',
+                                        NDJSON_MIMETYPE,
+                                        ])
+    return best == NDJSON_MIMETYPE
+
+
+def version_condition(etags):
+    """
+    Build the MongoDB condition on the image 'version' field from ETags.
+
+    Image ETag is its version, images created before versioning
+    have no 'version' field and are of version 0.
+
+    Args:
+        etags (werkzeug.datastructures.ETags): ETags of If-Match header.
+
+    Returns:
+        dict: Condition matching any of the versions.
+    """
+    versions = [int(etag) for etag in etags.as_set() if etag.isdigit()]
+    if 0 in versions:
+        versions.append(None)
+    return {'$in': versions}
@@ -0,0 +1,163 @@
+"""
+Raw BSON to JSON transcoder
+
+Writes JSON straight from BSON bytes returned by MongoDB (for example by
+'aggregate_raw_batches'), without decoding documents into Python dicts
+first. The output is the same as 'jsonify' with 'MongoJSONProvider'
+produces: relaxed extended JSON, sorted keys, compact separators.
+
+The transcoder is about 1.5 times faster than decoding the documents and
+serializing them with 'MongoJSONProvider', see benchmarks/raw_bson.py.
+
+Documents holding BSON types which are rare in this service (binary,
+regex, timestamp, decimal and so on) are decoded and serialized with
+'MongoJSONProvider' as usual.
+"""
+
+import json
+import struct
+from datetime import datetime, timedelta
+from json.encoder import encode_basestring_ascii
+from bson import decode
+from utils.utils import MongoJSONProvider
+
+_INT32 = struct.Struct('<i').unpack_from
+_INT64 = struct.Struct('<q').unpack_from
+_DOUBLE = struct.Struct('<d').unpack_from
+
+_EPOCH = datetime(1970, 1, 1)
+# the last millisecond of year 9999, the maximum python datetime
+_MAX_DATETIME_MS = 253402300799999
+
+# JSON of document keys by their BSON bytes
+_KEYS = {}
+_MAX_KEYS = 1024
+
+
+class _UnsupportedType(Exception):
+    """BSON type which is not transcoded directly."""
+
+
+def iter_raw_documents(batches):
+    """
+    Split raw batches of BSON documents into single documents.
+
+    Args:
+        batches (iterable): Bytes of concatenated BSON documents, as yielded
+            by 'aggregate_raw_batches' or 'find_raw_batches'.
+
+    Yields:
+        bytes: One BSON document.
+    """
+    for batch in batches:
+        position = 0
+        while position < len(batch):
+            size = _INT32(batch, position)[0]
+            yield batch[position:position + size]
+            position += size
+
+
+def document_to_json(document):
+    """
+    Convert one BSON document to a JSON string.
+
+    Args:
+        document (bytes): BSON document.
+
+    Returns:
+        str: JSON string equal to what 'MongoJSONProvider' produces
+        for the decoded document.
+    """
+    try:
+        return _document(document, 0)
+    except _UnsupportedType:
+        return json.dumps(decode(document),
+                          default=MongoJSONProvider.default,
+                          sort_keys=True,
+                          separators=(',', ':'),
+                          )
+
+
+def _document(data, start, array=False):
+    """Return JSON of the BSON document (or array) starting at start."""
+    end = start + _INT32(data, start)[0] - 1
+    position = start + 4
+    items = []
+    append = items.append
+    find = data.find
+    # one loop over the elements, the most frequent types of the /groups
+    # documents first, without a function call per value
+    while position < end:
+        kind = data[position]
+        key_end = find(b'\x00', position + 1)
+        key = data[position + 1:key_end]
+        position = key_end + 1
+        if kind == 0x02:  # string
+            length = _INT32(data, position)[0]
+            value = encode_basestring_ascii(
+                data[position + 4:position + 3 + length].decode()
+                )
+            position += 4 + length
+        elif kind == 0x07:  # ObjectId
+            value = f'{{"$oid":"{data[position:position + 12].hex()}"}}'
+            position += 12
+        elif kind == 0x09:  # UTC datetime
+            value = _datetime(_INT64(data, position)[0])
+            position += 8
+        elif kind == 0x03 or kind == 0x04:  # embedded document, array
+            size = _INT32(data, position)[0]
+            value = _document(data, position, kind == 0x04)
+            position += size
+        elif kind == 0x10:  # int32
+            value = str(_INT32(data, position)[0])
+            position += 4
+        elif kind == 0x12:  # int64
+            value = str(_INT64(data, position)[0])
+            position += 8
+        elif kind == 0x01:  # double
+            value = _float(_DOUBLE(data, position)[0])
+            position += 8
+        elif kind == 0x08:  # boolean
+            value = 'true' if data[position] else 'false'
+            position += 1
+        elif kind == 0x0A:  # null
+            value = 'null'
+        else:
+            raise _UnsupportedType
+        append((key, value))
+
+    if array:
+        return '[' + ','.join([value for _, value in items]) + ']'
+    # keys are unique, UTF-8 bytes sort in the order of their characters
+    items.sort()
+    return '{' + ','.join([f'{_KEYS.get(key) or _key(key)}:{value}'
+                           for key, value in items]) + '}'
+
+
+def _key(raw):
+    """Return JSON of a key, keys repeat in every document so are cached."""
+    key = encode_basestring_ascii(raw.decode())
+    if len(_KEYS) < _MAX_KEYS:
+        _KEYS[raw] = key
+    return key
+
+
+def _float(value):
+    if value != value:
+        return 'NaN'
+    if value in (float('inf'), float('-inf')):
+        return 'Infinity' if value > 0 else '-Infinity'
+    return float.__repr__(value)
+
+
+def _datetime(millis):
+    if millis < 0:
+        return f'{{"$date":{{"$numberLong":"{millis}"}}}}'
+    if millis > _MAX_DATETIME_MS:
+        raise _UnsupportedType
+    seconds, fraction = divmod(millis, 1000)
+    # years from 1970 on, isoformat is the same as '%Y-%m-%dT%H:%M:%S'
+    date = (_EPOCH + timedelta(seconds=seconds)).isoformat()
+    if fraction:
+        return f'{{"$date":"{date}.{fraction:03}Z"}}'
+    return f'{{"$date":"{date}Z"}}'
@@ -1,4 +1,7 @@
-from bson import json_util
+from bson import ObjectId, json_util
+from flask.json.provider import DefaultJSONProvider
+from itertools import islice
+import base64
 import json
 
 
@@ -34,3 +37,117 @@ def sanitize_json(mongo_db_data):
 
     json_sanitized = json.loads(json_util.dumps(mongo_db_data))
     return json_sanitized
+
+
+class MongoJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider which serializes MongoDB data types in one pass.
+
+    Special MongoDB data types, such as ObjectId and datetime, are converted
+    to the same (relaxed) extended JSON as sanitize_json produces, while the
+    response is being serialized. There is no need to dump data to a string
+    and load it back before passing it to jsonify.
+
+    Usage:
+        app.json = MongoJSONProvider(app)
+
+    Example:
+        jsonify({"_id": ObjectId("5f7d7b9932f03958701e3204")}) returns
+        {"_id": {"$oid": "5f7d7b9932f03958701e3204"}}
+    """
+
+    @staticmethod
+    def default(o):
+        try:
+            return json_util.default(
+                o,
+                json_options=json_util.RELAXED_JSON_OPTIONS,
+                )
+        except TypeError:
+            return DefaultJSONProvider.default(o)
+
+
+def encode_cursor(group):
+    """
+    Build an opaque pagination cursor from the last returned group.
+
+    The cursor holds the group's sort key ('name', '_id') so the next page
+    can start with an index seek right after it instead of skipping over
+    every group before it.
+
+    Args:
+        group (dict): Group document with 'name' and '_id' fields.
+
+    Returns:
+        str: URL-safe base64 string to pass back as the 'cursor' parameter.
+    """
+    key = json_util.dumps([group['name'], group['_id']])
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor created by encode_cursor back into the group sort key.
+
+    Args:
+        cursor (str): Value of the 'cursor' query parameter.
+
+    Returns:
+        tuple: ('name', '_id') of the last group of the previous page.
+
+    Raises:
+        ValueError: If the cursor is malformed or holds values of other
+            types than a string name and an ObjectId, such as query
+            operators.
+    """
+    try:
+        name, group_id = json_util.loads(base64.urlsafe_b64decode(cursor))
+    except Exception as err:
+        # extended JSON of a crafted cursor raises e.g. InvalidId,
+        # IndexError or OverflowError
+        raise ValueError(f"Invalid cursor - {cursor}") from err
+    # the values go straight into the $match of the next page
+    if not isinstance(name, str) or not isinstance(group_id, ObjectId):
+        raise ValueError(f"Invalid cursor - {cursor}")
+    return name, group_id
+
+
+def iter_json_array(documents, to_json, batch_size):
+    """
+    Serialize documents to a JSON array chunk by chunk.
+
+    Only batch_size documents are held in memory at once, so the array can
+    be streamed to the client whatever the number of documents is.
+
+    Args:
+        documents (iterable): Documents to serialize, e.g. a MongoDB cursor.
+        to_json (callable): Function returning JSON string of one document.
+        batch_size (int): Number of documents serialized into one chunk.
+
+    Yields:
+        str: Consecutive parts of the JSON array.
+    """
+    documents = iter(documents)
+    separator = '['
+    while batch := list(islice(documents, batch_size)):
+        yield separator + ','.join(map(to_json, batch))
+        separator = ','
+    yield ']' if separator == ',' else '[]'
+
+
+def iter_json_lines(documents, to_json):
+    """
+    Serialize documents to JSON Lines (NDJSON), one document per line.
+
+    Every line is yielded as soon as its document is read, so the client
+    can start processing while the rest of documents are being fetched.
+
+    Args:
+        documents (iterable): Documents to serialize, e.g. a MongoDB cursor.
+        to_json (callable): Function returning JSON string of one document.
+
+    Yields:
+        str: One JSON document followed by a new line.
+    """
+    for document in documents:
+        yield to_json(document) + '\n'
@@ -14,5 +14,13 @@ MONGODB_IMAGE_COLLECTION_NAME = os.environ.get('MONGODB_IMAGE_COLLECTION_NAME')
 MONGODB_GROUPS_COLLECTION_NAME = os.environ.get(
                                             'MONGODB_GROUPS_COLLECTION_NAME'
                                             )
+MONGODB_GROUP_STATS_COLLECTION_NAME = os.environ.get(
+                                    'MONGODB_GROUP_STATS_COLLECTION_NAME',
+                                    'group_stats',
+                                    )
+MONGODB_DAILY_COUNTS_COLLECTION_NAME = os.environ.get(
+                                    'MONGODB_DAILY_COUNTS_COLLECTION_NAME',
+                                    'daily_status_counts',
+                                    )
 
 IMAGE_FOLDER_NAME = os.environ.get('IMAGE_FOLDER_NAME')
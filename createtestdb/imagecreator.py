@@ -12,6 +12,8 @@ from config import (AWS_SERVICE_NAME,
                     MONGODB_DB_NAME,
                     MONGODB_IMAGE_COLLECTION_NAME,
                     MONGODB_GROUPS_COLLECTION_NAME,
+                    MONGODB_GROUP_STATS_COLLECTION_NAME,
+                    MONGODB_DAILY_COUNTS_COLLECTION_NAME,
                     IMAGE_FOLDER_NAME
                     )
 
@@ -29,11 +31,15 @@ client = MongoClient(MONGODB_URI)
 db = client[MONGODB_DB_NAME]
 images_collection = db[MONGODB_IMAGE_COLLECTION_NAME]
 groups_collection = db[MONGODB_GROUPS_COLLECTION_NAME]
+group_stats_collection = db[MONGODB_GROUP_STATS_COLLECTION_NAME]
+daily_counts_collection = db[MONGODB_DAILY_COUNTS_COLLECTION_NAME]
 
 
 # clean database
 images_collection.delete_many({})
 groups_collection.delete_many({})
+group_stats_collection.delete_many({})
+daily_counts_collection.delete_many({})
 
 # create images and database entry
 statuses = ["new", "review", "accepted", "deleted"]
@@ -106,13 +112,42 @@ for group_numer in range(n):
                                         AWS_SERVICE_NAME,
                                         AWS_REGION,
                                         )
+        created_at = datetime.utcnow()
         image = {
-            'created_at': datetime.utcnow(),
+            'created_at': created_at,
             'last_updated_at': datetime.utcnow(),
             'url': image_url,
             'status': statuses[image_number % 4],
-            'group_id': group_id
+            'group_id': group_id,
+            'version': 0,
         }
         images_collection.insert_one(image)
+        # keep per group image counts of the backend up to date
+        group_stats_collection.update_one(
+            {'_id': group_id},
+            {'$inc': {'total': 1, f"counts.{image['status']}": 1}},
+            upsert=True,
+            )
+        # and the daily status counts of /statistics
+        daily_counts_collection.update_one(
+            {
+                'day': datetime(created_at.year,
+                                created_at.month,
+                                created_at.day,
+                                ),
+                'status': image['status'],
+            },
+            {'$inc': {'count': 1}},
+            upsert=True,
+            )
+
+# all groups and days are counted, the backend reads counts from
+# group_stats and daily_status_counts
+for collection in (group_stats_collection, daily_counts_collection):
+    collection.update_one(
+        {'_id': 'built'},
+        {'$set': {'built_at': datetime.utcnow()}},
+        upsert=True,
+        )
 
 print("Test database was created")